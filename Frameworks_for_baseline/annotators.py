@@ -0,0 +1,311 @@
+"""
+Annotators of the baseline frameworks and the runner shared by the Use_*.py scripts.
+
+An annotator turns the text of a row into the list of its keywords ({"originalKey", "original_value",
+"Wikidata_ID", ...}, the format read by evaluation.py). run_annotators() reads the CSV files of the
+narratives once, and every annotator works on the rows at the same time as the others, with its own
+pool of `workers` threads, a pooled session and the shared rate limiter of rate_limit.py.
+The errors are isolated per row: the row is saved without keywords and with an "error" field (so the
+exported files stay aligned with the gold standard) and it is requested again by the next run, which
+skips the rows already annotated. Every annotator has a store <output_folder>/<name>.jsonl, exported in
+<output_folder>/<name>/<narrative>.csv.json.
+
+python annotators.py                                          the four frameworks at the same time
+python annotators.py --annotators tagme dbpedia --tagme-token ...
+
+A new baseline is a subclass of Annotator (name, workers, annotate(text)) added to ANNOTATORS.
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# shared modules in the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from result_store import ResultStore, read_records, export_json_files
+from qid_cache import QidCache
+from sparql_batch import BatchSparqlResolver
+from getWidataIdUsingWikipediaAPIs import get_wikidata_entities_from_wikipedia_titles, make_session
+from rate_limit import print_report
+
+
+class Annotator:
+    """
+    Base class: `name` is the model name in the store and the output folder, `workers` the number of
+    concurrent requests to the service
+    """
+    name = None
+    workers = 1
+
+    def __init__(self, workers=None):
+        if workers:
+            self.workers = workers
+        self.session = make_session(self.workers)
+
+    def annotate(self, text):
+        """
+        Keywords of a text; an exception marks the row as failed
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class DBpediaSpotlightAnnotator(Annotator):
+    """
+    DBpedia Spotlight, with the Wikidata IDs of the DBpedia URIs from the owl:sameAs links
+    (one batched SPARQL query per row, through the persistent QidCache)
+    """
+    name = "DBpedia Spotlight"
+    workers = 4
+
+    def __init__(self, lang="en", confidence=0.5, support=20, sparql_endpoint="https://dbpedia.org/sparql",
+                 qid_cache=None, workers=None):
+        super().__init__(workers)
+        self.url = f"https://api.dbpedia-spotlight.org/{lang}/annotate"
+        self.confidence = confidence
+        self.support = support
+        self.qid_cache = qid_cache if qid_cache is not None else QidCache()
+        self.sparql_resolver = BatchSparqlResolver(sparql_endpoint, batch_size=50, session=self.session)
+
+    def wikidata_ids(self, dbpedia_uris):
+        """
+        {uri: 'Q76' or 'null' if not found}; the errors of the SPARQL endpoint are not cached
+        """
+        results = self.qid_cache.resolve_many("dbpedia", dbpedia_uris, self.sparql_resolver.dbpedia_to_wikidata)
+        return {uri: results.get(uri) or "null" for uri in dbpedia_uris}
+
+    def annotate(self, text):
+        data = {"text": text, "confidence": str(self.confidence), "support": str(self.support)}
+        response = self.session.post(self.url, data=data, headers={"Accept": "application/json"}, timeout=60)
+        response.raise_for_status()
+
+        resources = response.json().get("Resources", [])
+        if not isinstance(resources, list):
+            # with only one resource the API returns a dict
+            resources = [resources]
+        resources = [res for res in resources if res.get("@URI")]
+        wikidata_ids = self.wikidata_ids([res["@URI"] for res in resources])
+
+        keywords = []
+        seen = set()
+        for res in resources:
+            dbpedia_uri = res["@URI"]
+            entity = {
+                "originalKey": res.get("@surfaceForm", ""),
+                # readable label from the URI (last part, underscores as spaces)
+                "original_value": urllib.parse.unquote(dbpedia_uri.rsplit("/", 1)[-1]).replace("_", " "),
+                "DBpedia_URI": dbpedia_uri,
+                "Wikidata_ID": wikidata_ids[dbpedia_uri]
+            }
+            key = (entity["originalKey"], entity["Wikidata_ID"])
+            if key not in seen:
+                seen.add(key)
+                keywords.append(entity)
+        return keywords
+
+    def stats(self):
+        return {"sparql": self.sparql_resolver.stats, "cache": self.qid_cache.stats().get("dbpedia")}
+
+
+class FalconAnnotator(Annotator):
+    name = "Falcon 2.0"
+    workers = 1
+
+    def __init__(self, url="https://labs.tib.eu/falcon/falcon2/api?mode=long", workers=None):
+        super().__init__(workers)
+        self.url = url
+
+    def annotate(self, text):
+        response = self.session.post(self.url, headers={"Content-Type": "application/json"}, json={"text": text},
+                                     timeout=60)
+        response.raise_for_status()
+        return [{
+            "originalKey": annotation["surface form"],
+            "original_value": annotation["surface form"],
+            "Wikidata_ID": annotation["URI"]
+        } for annotation in response.json()["entities_wikidata"]]
+
+
+class JSIWikifierAnnotator(Annotator):
+    name = "JSI wikifier"
+    workers = 2
+
+    def __init__(self, user_key="YOUR USER KEY HERE", lang="en", threshold=0.7,
+                 url="http://www.wikifier.org/annotate-article", workers=None):
+        super().__init__(workers)
+        self.user_key = user_key
+        self.lang = lang
+        self.threshold = threshold
+        self.url = url
+
+    def annotate(self, text):
+        data = [
+            ("text", text), ("lang", self.lang),
+            ("support", "true"),
+            ("userKey", self.user_key),
+            ("pageRankSqThreshold", "%g" % self.threshold), ("applyPageRankSqThreshold", "true"),
+            ("nTopDfValuesToIgnore", "200"), ("nWordsToIgnoreFromList", "200"),
+            ("wikiDataClasses", "true"), ("wikiDataClassIds", "false"),
+            ("support", "true"), ("ranges", "false"), ("minLinkFrequency", "2"),
+            ("includeCosines", "false"), ("maxMentionEntropy", "3")
+        ]
+        response = self.session.post(self.url, data=data, timeout=60)
+        response.raise_for_status()
+        response = response.json()
+        words = response.get("words", [])
+
+        keywords = []
+        for annotation in response["annotations"]:
+            w_from = annotation["support"][0]["wFrom"]
+            w_to = annotation["support"][0]["wTo"]
+            keywords.append({
+                "originalKey": " ".join(words[w_from:w_to + 1]),
+                "original_value": annotation["title"],
+                "Wikidata_ID": annotation.get("wikiDataItemId", "null")
+            })
+        return keywords
+
+
+class TagmeAnnotator(Annotator):
+    """
+    TAGME, with the Wikidata IDs of the Wikipedia titles (50 per request, through the persistent QidCache,
+    or offline with the index of offline_titles.py)
+    """
+    name = "TAGME"
+    workers = 2
+
+    def __init__(self, token="your token here", lang="en", qid_cache=None, offline_folder=None,
+                 url="https://tagme.d4science.org/tagme/tag", workers=None):
+        super().__init__(workers)
+        self.token = token
+        self.lang = lang
+        self.url = url
+        self.offline_folder = offline_folder
+        self.qid_cache = qid_cache if qid_cache is not None else QidCache()
+        self.titles = {}
+
+    def annotate(self, text):
+        params = {"text": text, "lang": self.lang, "gcube-token": self.token}
+        response = self.session.post(self.url, params=params, timeout=60)
+        response.raise_for_status()
+        annotations = response.json().get("annotations", [])
+
+        # wikidata ids of all the wikipedia titles found by TAGME in the row
+        titles = [annotation.get("title") for annotation in annotations if annotation.get("title")]
+        resolved = get_wikidata_entities_from_wikipedia_titles(self.lang, titles, self.session, cache=self.titles,
+                                                               qid_cache=self.qid_cache,
+                                                               offline_folder=self.offline_folder)
+        return [{
+            "originalKey": annotation.get("spot"),
+            "original_value": annotation["title"],
+            "Wikidata_ID": resolved.get(annotation["title"]),
+            "rho": annotation.get("rho")
+        } for annotation in annotations if annotation.get("title")]
+
+    def stats(self):
+        return {"cache": self.qid_cache.stats().get(f"wikipedia:{self.lang}")}
+
+
+ANNOTATORS = {
+    "dbpedia": DBpediaSpotlightAnnotator,
+    "falcon": FalconAnnotator,
+    "wikifier": JSIWikifierAnnotator,
+    "tagme": TagmeAnnotator,
+}
+
+
+def iter_rows(directory):
+    """
+    (narrative file, row, text) of the second column of every CSV in the folder, without the header
+    """
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".csv"):
+            continue
+        with open(os.path.join(directory, filename), newline='', encoding='utf-8') as csvfile:
+            csvreader = csv.reader(csvfile)
+            next(csvreader, None)
+            for i, row in enumerate(csvreader):
+                if len(row) > 1:
+                    yield filename, i, row[1]
+
+
+def done_rows(store_path, name):
+    """
+    (narrative, row) already annotated without errors
+    """
+    return {(r["narrative"], r["row"]) for r in read_records(store_path) if r["model"] == name and not r.get("error")}
+
+
+def annotate_row(annotator, store, filename, i, text):
+    """
+    Annotate and save one row; return False if the annotator failed
+    """
+    if not text.strip():
+        store.append(annotator.name, filename, i, {"keywords": []})
+        return True
+    try:
+        keywords = annotator.annotate(text)
+    except Exception as e:
+        logging.error(f"{annotator.name}: errore su {filename}, riga {i}: {e}")
+        store.append(annotator.name, filename, i, {"keywords": []}, error=str(e))
+        return False
+    store.append(annotator.name, filename, i, {"keywords": keywords})
+    return True
+
+
+def run_annotator(annotator, rows, output_folder):
+    """
+    Annotate the rows not yet in the store of the annotator and export its json files. Return the errors
+    """
+    store_path = os.path.join(output_folder, annotator.name + ".jsonl")
+    done = done_rows(store_path, annotator.name)
+    todo = [row for row in rows if (row[0], row[1]) not in done]
+
+    start = time.monotonic()
+    with ResultStore(store_path) as store, ThreadPoolExecutor(annotator.workers) as pool:
+        errors = sum(not ok for ok in pool.map(lambda row: annotate_row(annotator, store, *row), todo))
+
+    export_json_files(store_path, output_folder, models=[annotator.name])
+    print(f"{annotator.name}: {len(todo) - errors}/{len(todo)} righe annotate ({len(done)} gia' fatte), "
+          f"{errors} errori, {time.monotonic() - start:.0f}s")
+    stats = annotator.stats()
+    if stats:
+        print(f"{annotator.name}: {stats}")
+    return errors
+
+
+def run_annotators(annotators, directory, output_folder):
+    """
+    Run the annotators at the same time on all the rows of the narratives. Return {name: errors}
+    """
+    rows = list(iter_rows(directory))
+    with ThreadPoolExecutor(len(annotators)) as pool:
+        errors = list(pool.map(lambda annotator: run_annotator(annotator, rows, output_folder), annotators))
+    print_report()
+    return {annotator.name: n for annotator, n in zip(annotators, errors)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annotate the narratives with the baseline frameworks")
+    parser.add_argument("--annotators", nargs="+", choices=list(ANNOTATORS), default=list(ANNOTATORS))
+    parser.add_argument("--directory", default="../selected_MOVING_narratives")
+    parser.add_argument("--output", default="baseline_data_output")
+    parser.add_argument("--workers", type=int, help="concurrent requests per framework (default: per framework)")
+    parser.add_argument("--tagme-token", default="your token here")
+    parser.add_argument("--wikifier-key", default="YOUR USER KEY HERE")
+    parser.add_argument("--offline-folder", help="index of offline_titles.py for the titles of TAGME")
+    args = parser.parse_args()
+
+    options = {
+        "tagme": {"token": args.tagme_token, "offline_folder": args.offline_folder},
+        "wikifier": {"user_key": args.wikifier_key},
+    }
+    annotators = [ANNOTATORS[name](workers=args.workers, **options.get(name, {})) for name in args.annotators]
+    run_annotators(annotators, args.directory, args.output)
@@ -0,0 +1,52 @@
+"""
+Bounded-concurrency runner: submit all the texts of one model to Ollama at the same time
+(at most `concurrency` requests in flight, see OLLAMA_NUM_PARALLEL) and hand the answers
+back in the original order.
+"""
+
+import asyncio
+
+
+async def _generate(llm, semaphore, index, text):
+    async with semaphore:
+        # the client is blocking, run it in a worker thread
+        answer = await asyncio.to_thread(llm, text)
+    return index, answer
+
+
+async def generate_all(llm, texts, concurrency=4, on_result=None):
+    """
+    Call the LLM on every text with at most `concurrency` calls in flight.
+    Answers are collected out of order, but `on_result(index, answer)` is called in
+    row order as soon as all the previous rows are done. Return the list of the answers.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.create_task(_generate(llm, semaphore, i, text)) for i, text in enumerate(texts)]
+
+    answers = [None] * len(texts)
+    ready = [False] * len(texts)
+    next_index = 0
+
+    try:
+        for finished in asyncio.as_completed(tasks):
+            index, answer = await finished
+            answers[index] = answer
+            ready[index] = True
+
+            # flush the completed prefix in deterministic order
+            while next_index < len(texts) and ready[next_index]:
+                if on_result:
+                    on_result(next_index, answers[next_index])
+                next_index += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return answers
+
+
+def run_async(llm, texts, concurrency=4, on_result=None):
+    """
+    Synchronous entry point of generate_all
+    """
+    return asyncio.run(generate_all(llm, texts, concurrency, on_result))
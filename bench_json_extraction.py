@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of the json extraction on the raw answers of the LLMs.
+
+The raw answers are read from the LLM cache (llmcache/sha*.json, see response_cache.py) or from a
+JSONL file with a "response" field per line. The old greedy-regex extractor of ollama.py is compared
+with estrai_json_da_stringa of json_extraction.py: time per answer and how the json was obtained.
+
+python bench_json_extraction.py --cache llmcache
+python bench_json_extraction.py --jsonl raw_answers.jsonl --repeat 20
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import time
+
+from json_extraction import estrai_json_da_stringa
+
+
+def estrai_json_regex(stringa, stats):
+    """
+    The previous extractor (greedy regex + cleaning + json_repair), without the logging
+    """
+    match = re.search(r'\{.*\}', stringa, re.DOTALL)
+    if not match:
+        stats["no_json"] = stats.get("no_json", 0) + 1
+        return None
+    json_string_pulito = re.sub(r',\s*(\}|\])', r'\1', match.group(0))
+    try:
+        parsed = json.loads(json_string_pulito)
+        stats["strict"] = stats.get("strict", 0) + 1
+        return parsed
+    except json.JSONDecodeError:
+        from json_repair import repair_json
+        try:
+            parsed = json.loads(repair_json(json_string_pulito))
+            stats["repaired"] = stats.get("repaired", 0) + 1
+            return parsed
+        except Exception:
+            stats["failed"] = stats.get("failed", 0) + 1
+            return None
+
+
+def load_answers(cache_folder=None, jsonl=None):
+    answers = []
+    if cache_folder:
+        for path in glob.glob(os.path.join(cache_folder, "sha*.json")):
+            with open(path, 'r', encoding='utf-8') as file:
+                answers.append(json.load(file)["response"])
+    if jsonl:
+        with open(jsonl, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    answers.append(json.loads(line)["response"])
+    return answers
+
+
+def bench(name, function, answers, repeat):
+    stats = {}
+    start = time.perf_counter()
+    for i in range(repeat):
+        run_stats = stats if i == 0 else {}
+        for answer in answers:
+            function(answer, run_stats)
+    elapsed = time.perf_counter() - start
+    per_answer = elapsed / (repeat * len(answers)) * 1e6
+    print(f"{name:<10} {per_answer:10.1f} us/answer   {stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the json extraction on the raw LLM answers")
+    parser.add_argument("--cache", default="llmcache", help="folder of the LLM cache")
+    parser.add_argument("--jsonl", help="JSONL file with the raw answers (field 'response')")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    answers = load_answers(args.cache, args.jsonl)
+    if not answers:
+        print("Nessuna risposta trovata: esegui ollama.py con use_cache = True o usa --jsonl")
+        raise SystemExit(1)
+
+    # the logging of the failures is not part of the measure
+    logging.disable(logging.CRITICAL)
+
+    print(f"{len(answers)} risposte, {args.repeat} ripetizioni")
+    bench("regex", estrai_json_regex, answers, args.repeat)
+    bench("scanner", lambda answer, stats: estrai_json_da_stringa(answer, "", stats), answers, args.repeat)
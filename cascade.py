@@ -0,0 +1,219 @@
+"""
+Model cascade for the first approach (prompt 1, the LLM gives the Wikidata ID).
+
+Every row is first linked by a cheap model; the row goes to the large model only when the answer
+of the cheap model does not pass cheap checks:
+- "empty": no keywords (also the answers without a valid json, saved as {"keywords": []});
+- "bad_qid": more than max_bad_qids of the Wikidata IDs are not QIDs, or (validate_qids) do not
+  exist in Wikidata (QidValidator of resolvers.py, one batched request per 50 ids);
+- "low_agreement": the Jaccard index between the QIDs of the row and the ones of a baseline annotator
+  (e.g. Evaluation/baseline/DBpedia Spotlight) is lower than min_agreement.
+  The baseline rows are taken by (narrative, row) from the store of Frameworks_for_baseline/annotators.py
+  (baseline_store) when there is one; the exported files have only a list of items, so a row is
+  matched by its position among all the rows of the narrative, or among the non-empty ones, when the
+  number of items says which one was used, and the check is skipped for the other files.
+
+The output of the cascade is <output_folder>/<cascade>/<file>.csv.json, in the format of evaluation.py.
+The report gives the fraction of rows escalated, the F1 of the cheap model, of the cascade and of the
+large model on every row (large_reference_folder), and the cost of the cascade against the large
+model on every row, from the mean latency per call of the two models in the telemetry (metrics_folder).
+
+python cascade.py --cheap gemma2:2b --large phi4:14b-q8_0
+"""
+
+import argparse
+import os
+import re
+from collections import Counter
+
+import ollama
+from evaluation import calculate_metrics, load_json_files
+from linking_pipeline import load_mentions
+from resolvers import QidValidator
+from qid_cache import QidCache
+from result_store import prompt_id, read_records, save_json_atomic
+from telemetry import load_metrics
+
+cheap_model = "gemma2:2b"
+large_model = "phi4:14b-q8_0"
+cascade_store = "cascade/results.jsonl"
+output_folder = "cascade"
+baseline_folder = "Evaluation/baseline/DBpedia Spotlight"   # None to skip the agreement check
+# store of annotators.py with the (narrative, row) of every item, used instead of baseline_folder if it exists
+baseline_store = "Frameworks_for_baseline/baseline_data_output/DBpedia Spotlight.jsonl"
+large_reference_folder = "Evaluation/first_approach/phi4 14b"   # large model on every row (None to skip)
+gold_folder = "gold_standard/"
+min_agreement = 0.2
+max_bad_qids = 0.5
+validate_qids = True
+jaccard = 1
+
+QID = re.compile(r"^Q\d+$")
+
+
+def item_qids(item, field="wikidata_id"):
+    """
+    Wikidata IDs of the keywords of an item (as strings, stripped)
+    """
+    return [str(entity.get(field) or "").strip() for entity in item.get("keywords", [])
+            if isinstance(entity, dict)]
+
+
+def escalation_reasons(item, baseline_item=None, existing=None):
+    """
+    Reasons to send the row to the large model (empty list: the answer of the cheap model is kept).
+    `existing` is the set of the QIDs that exist in Wikidata (None: not checked)
+    """
+    if not item or not isinstance(item.get("keywords"), list) or not item["keywords"]:
+        return ["empty"]
+
+    reasons = []
+    qids = item_qids(item)
+    bad = [q for q in qids if not QID.match(q) or (existing is not None and q not in existing)]
+    if len(bad) > max_bad_qids * len(qids):
+        reasons.append("bad_qid")
+
+    if baseline_item:
+        baseline_qids = {q for q in item_qids(baseline_item, "Wikidata_ID") if QID.match(q)}
+        if baseline_qids:
+            found = {q for q in qids if QID.match(q)}
+            agreement = len(found & baseline_qids) / len(found | baseline_qids)
+            if agreement < min_agreement:
+                reasons.append("low_agreement")
+    return reasons
+
+
+def baseline_items(narratives):
+    """
+    {(narrative, row): item of the baseline annotator}, see the docstring of the module
+    """
+    if baseline_store and os.path.exists(baseline_store):
+        # the last record of a row wins, as in export_json_files
+        return {(r["narrative"], r["row"]): r["item"] for r in read_records(baseline_store) if not r.get("error")}
+    if not baseline_folder:
+        return {}
+
+    files = load_json_files(baseline_folder)
+    by_file = {}
+    for filename, row, text in narratives:
+        by_file.setdefault(filename, []).append((row, text))
+    aligned = {}
+    unaligned = []
+    for filename, rows in by_file.items():
+        items = files.get(filename + ".json")
+        if not items:
+            continue
+        non_empty = [row for row, text in rows if text.strip()]
+        if len(items) == len(rows):
+            used = [row for row, _ in rows]
+        elif len(items) == len(non_empty):
+            used = non_empty
+        else:
+            unaligned.append(filename)
+            continue
+        aligned.update({(filename, row): item for row, item in zip(used, items)})
+    if unaligned:
+        print(f"Baseline non allineabile con le righe (numero di elementi diverso) per {len(unaligned)} file: "
+              f"controllo di accordo saltato per {', '.join(sorted(unaligned))}")
+    return aligned
+
+
+def to_evaluation_format(item):
+    return {"keywords": [{"originalKey": entity.get("keyword_in_the_text"), "Wikidata_ID": entity.get("wikidata_id")}
+                         for entity in (item or {}).get("keywords", []) if isinstance(entity, dict)]}
+
+
+def mean_latency(records, model):
+    """
+    Mean seconds per generated (not cached) call of a model in the telemetry
+    """
+    calls = [r for r in records if r["model"] == model and not r.get("cached")]
+    if not calls:
+        return None
+    return sum(r["total_duration"] / 1e9 if "total_duration" in r else r["wall_time"] for r in calls) / len(calls)
+
+
+def run_cascade(cheap, large, system=ollama.systemPrompt, id_field="wikidata_id"):
+    """
+    Cheap model on every row, large model on the escalated rows.
+    Return {file: [items]} of the cascade and {file: [items]} of the cheap model, in evaluation format
+    """
+    prompt = prompt_id(system)
+    narratives = ollama.load_narratives(ollama.directory)
+    ollama.run_models([cheap], system, id_field, cascade_store, None)
+    cheap_items = load_mentions(cascade_store, prompt)
+
+    baseline = baseline_items(narratives)
+    existing = None
+    if validate_qids:
+        values = {q for rows in cheap_items.values() for item in rows.values() for q in item_qids(item) if QID.match(q)}
+        existing = {q for q, resolved in QidValidator(qid_cache=QidCache()).resolve_many(values).items() if resolved}
+
+    reasons = {}
+    for filename, row, _ in narratives:
+        item = cheap_items.get((cheap, filename), {}).get(row)
+        reasons[(filename, row)] = escalation_reasons(item, baseline.get((filename, row)), existing)
+
+    # the large model runs only on the escalated rows
+    skip = {(large, prompt, filename, row) for (filename, row), why in reasons.items() if not why}
+    escalated = len(reasons) - len(skip)
+    if escalated:
+        ollama.run_models([large], system, id_field, cascade_store, None, skip=skip)
+    large_items = load_mentions(cascade_store, prompt)
+
+    cascade, cheap_only = {}, {}
+    for filename, row, _ in narratives:
+        cheap_item = cheap_items.get((cheap, filename), {}).get(row)
+        item = cheap_item
+        if reasons[(filename, row)]:
+            item = large_items.get((large, filename), {}).get(row, cheap_item)
+        cascade.setdefault(filename + ".json", []).append(to_evaluation_format(item))
+        cheap_only.setdefault(filename + ".json", []).append(to_evaluation_format(cheap_item))
+
+    name = f"cascade {cheap} - {large}"
+    for label, data in ((name, cascade), (cheap, cheap_only)):
+        folder = os.path.join(output_folder, label)
+        os.makedirs(folder, exist_ok=True)
+        for filename, items in data.items():
+            save_json_atomic(items, os.path.join(folder, filename))
+
+    report(cheap, large, reasons, cascade, cheap_only)
+    return cascade, cheap_only
+
+
+def report(cheap, large, reasons, cascade, cheap_only):
+    total = len(reasons)
+    escalated = sum(1 for why in reasons.values() if why)
+    counts = Counter(reason for why in reasons.values() for reason in why)
+    print(f"\nRighe passate a {large}: {escalated}/{total} ({escalated / total:.1%}) - motivi: {dict(counts)}")
+
+    gold = load_json_files(gold_folder)
+    results = [(f"{cheap} (tutte le righe)", cheap_only), (f"cascata {cheap} -> {large}", cascade)]
+    if large_reference_folder and os.path.isdir(large_reference_folder):
+        results.append((f"{large} (tutte le righe)", load_json_files(large_reference_folder)))
+    if gold:
+        print("Model | Precision | Recall | F1 Score")
+        print("-" * 50)
+        for label, data in results:
+            precision, recall, f1, _, _, _ = calculate_metrics(gold, data, jaccard)
+            print(f"{label} | {precision:.4f} | {recall:.4f} | {f1:.4f}")
+
+    records = load_metrics([ollama.metrics_folder]) if os.path.isdir(ollama.metrics_folder) else []
+    cheap_s, large_s = mean_latency(records, cheap), mean_latency(records, large)
+    if cheap_s is None or large_s is None:
+        print("Costo: latenze non disponibili nella telemetria")
+        return
+    cascade_cost = total * cheap_s + escalated * large_s
+    large_cost = total * large_s
+    print(f"Costo stimato: cascata {cascade_cost:.0f}s, {large} su tutte le righe {large_cost:.0f}s "
+          f"({cascade_cost / large_cost:.1%}; {cheap_s:.2f}s e {large_s:.2f}s per chiamata)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cheap model first, large model only on the rows that fail the checks")
+    parser.add_argument("--cheap", default=cheap_model)
+    parser.add_argument("--large", default=large_model)
+    args = parser.parse_args()
+    ollama.setup_logging()
+
+    run_cascade(args.cheap, args.large)
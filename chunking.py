@@ -0,0 +1,96 @@
+"""
+Sliding-window chunking of the long narrative rows.
+
+A long text is split in overlapping windows (cut at the end of a sentence when possible), each
+window is sent to the LLM as an independent call, and the keywords found in the windows are merged
+in one {"keywords": [...]} item for the row: every keyword gets the offset of its mention in the
+original text, and a mention found in more windows (e.g. in the overlap of two windows) is kept once,
+as in the answer of a single call.
+"""
+
+
+def _cut_position(text, start, end):
+    """
+    Best position <= end to cut the window: end of a sentence, otherwise a space
+    """
+    if end >= len(text):
+        return len(text)
+    half = start + (end - start) // 2
+    for separator in (". ", "! ", "? ", "\n", "; ", ", ", " "):
+        position = text.rfind(separator, half, end)
+        if position != -1:
+            return position + len(separator)
+    return end
+
+
+def split_windows(text, window_chars=2000, overlap_chars=300):
+    """
+    Split a text in overlapping windows. Return a list of (start, window_text),
+    with start the offset of the window in the text
+    """
+    if len(text) <= window_chars:
+        return [(0, text)]
+
+    windows = []
+    start = 0
+    while start < len(text):
+        end = _cut_position(text, start, start + window_chars)
+        windows.append((start, text[start:end]))
+        if end >= len(text):
+            break
+
+        # the next window starts overlap_chars before the end, at the beginning of a word
+        next_start = max(end - overlap_chars, start + 1)
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return windows
+
+
+def _id_fields(keyword):
+    return tuple(sorted((k, str(v)) for k, v in keyword.items() if k not in ("keyword_in_the_text", "offset")))
+
+
+def merge_mentions(text, chunk_items):
+    """
+    Merge the items extracted from the windows of a text.
+    chunk_items is a list of (start, window_text, item) with item = {"keywords": [...]} (or None).
+    The keywords get the "offset" of the mention in the original text (None if not found)
+    and the duplicates (same mention, case insensitive, with the same ids) are removed.
+    """
+    merged = []
+    seen = {}
+    lower_text = text.lower()
+
+    for start, window_text, item in chunk_items:
+        if not item or not isinstance(item.get("keywords"), list):
+            continue
+        lower_window = window_text.lower()
+        for keyword in item["keywords"]:
+            if not isinstance(keyword, dict):
+                continue
+            mention = str(keyword.get("keyword_in_the_text") or "")
+            offset = None
+            if mention:
+                position = lower_window.find(mention.lower())
+                if position != -1:
+                    offset = start + position
+                else:
+                    # the model may quote a mention of another part of the text
+                    position = lower_text.find(mention.lower())
+                    offset = position if position != -1 else None
+
+            key = (mention.lower(), _id_fields(keyword))
+            if key in seen:
+                kept = seen[key]
+                if kept["offset"] is None or (offset is not None and offset < kept["offset"]):
+                    kept["offset"] = offset if offset is not None else kept["offset"]
+                continue
+
+            new_keyword = dict(keyword)
+            new_keyword["offset"] = offset
+            seen[key] = new_keyword
+            merged.append(new_keyword)
+
+    # mentions in order of appearance in the text, the ones without offset at the end
+    merged.sort(key=lambda k: (k["offset"] is None, k["offset"] or 0))
+    return {"keywords": merged}
@@ -503,40 +503,42 @@ def fp_percentages_per_model(gold_folder, root_folder, jaccard_threshold, nullTP
 
 
 
-# parameters (change the root_folder for evaluating the other approaches)
-metric_type = "keyword linking"
-gold_folder = "gold_standard/"
+if __name__ == "__main__":
 
-root_folder = "Evaluation/third_approach/"
+    # parameters (change the root_folder for evaluating the other approaches)
+    metric_type = "keyword linking"
+    gold_folder = "gold_standard/"
 
-jaccard = 1
+    root_folder = "Evaluation/third_approach/"
+
+    jaccard = 1
 
 
     
-# print keywords for a jaccard threshold    
-#process_folders_recursively(gold_folder, root_folder, jaccard, stampaFN=True)
+    # print keywords for a jaccard threshold    
+    #process_folders_recursively(gold_folder, root_folder, jaccard, stampaFN=True)
 
 
-#Print precision, recall and f1 of 1 approach
-sorted_metrics = sort_metrics(root_folder, gold_folder, metric_type, jaccard)
-print(f"\nResults order by F1 Score ({metric_type}):")
-print("Model | Precision | Recall | F1 Score")
-print("-" * 50)
-for folder, precision, recall, f1_score in sorted_metrics:
-    print(f"{folder} | {precision:.4f} | {recall:.4f} | {f1_score:.4f}")
+    #Print precision, recall and f1 of 1 approach
+    sorted_metrics = sort_metrics(root_folder, gold_folder, metric_type, jaccard)
+    print(f"\nResults order by F1 Score ({metric_type}):")
+    print("Model | Precision | Recall | F1 Score")
+    print("-" * 50)
+    for folder, precision, recall, f1_score in sorted_metrics:
+        print(f"{folder} | {precision:.4f} | {recall:.4f} | {f1_score:.4f}")
 
 
-# print results of the best jcaccard threshold  
-df_results = best_f1_per_model(
-    gold_folder=gold_folder,
-    root_folder=root_folder,
-    metric_type="keyword linking"   
-)
+    # print results of the best jcaccard threshold  
+    df_results = best_f1_per_model(
+        gold_folder=gold_folder,
+        root_folder=root_folder,
+        metric_type="keyword linking"   
+    )
 
-# # print plot of f1, precision and recall for each jaccard threshold 
-#plot_all_metrics_trend(gold_folder, root_folder)
+    # # print plot of f1, precision and recall for each jaccard threshold 
+    #plot_all_metrics_trend(gold_folder, root_folder)
 
 
 
-#f_fp = fp_percentages_per_model(gold_folder, root_folder, jaccard)
+    #f_fp = fp_percentages_per_model(gold_folder, root_folder, jaccard)
     
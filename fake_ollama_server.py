@@ -0,0 +1,302 @@
+"""
+Local, deterministic stand-in of the Ollama server, to benchmark and test the pipeline without a GPU.
+
+It speaks the generate API (POST /api/generate, streaming or not) used by llm_client.OllamaClient:
+- the answers are replayed from a JSONL file of recorded completions ({"model", "prompt" or
+  "prompt_sha1", "response"}), otherwise a keywords json valid for the prompt is synthesized
+  from the capitalized words of the text;
+- every generated token costs token_latency seconds, loading a model costs load_time seconds
+  (only max_loaded models stay loaded, the others are unloaded like in Ollama);
+- a fraction failure_rate of the requests fails with HTTP 500 (deterministic, from the seed);
+- at most num_parallel requests are served at the same time (OLLAMA_NUM_PARALLEL).
+GET /stats returns the counters of the server (requests, failures, loads, tokens, cancelled).
+
+python fake_ollama_server.py --port 11434 --token-latency 0.005 --load-time 2 --failure-rate 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def prompt_hash(prompt):
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+def load_recordings(path):
+    """
+    {(model, prompt_sha1): response} from a JSONL file of recorded completions
+    """
+    recordings = {}
+    if not path:
+        return recordings
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            key = record.get("prompt_sha1") or prompt_hash(record["prompt"])
+            recordings[(record["model"], key)] = record["response"]
+    return recordings
+
+
+def synthesize_answer(system, prompt, fmt=None, max_keywords=8):
+    """
+    Keywords json valid for the prompt: the capitalized words of the text are the mentions, and the
+    id field (wikidata_id / wikipedia_title) is the one asked by the system prompt or by the schema.
+    A packed prompt (see prompt_packing.py) gets {"texts": [{"id": n, "keywords": [...]}, ...]}
+    """
+    if isinstance(fmt, dict) and "texts" in fmt.get("properties", {}):
+        fmt = {"properties": fmt["properties"]["texts"]["items"]["properties"]}
+    parts = re.split(r"^### Text (\d+)\n", prompt, flags=re.MULTILINE)
+    if len(parts) > 1:
+        texts = [{"id": int(parts[i]), **json.loads(synthesize_answer(system, parts[i + 1], fmt, max_keywords))}
+                 for i in range(1, len(parts) - 1, 2)]
+        return json.dumps({"texts": texts}, ensure_ascii=False)
+
+    fields = []
+    if isinstance(fmt, dict):
+        try:
+            fields = list(fmt["properties"]["keywords"]["items"]["properties"])
+        except (KeyError, TypeError):
+            fields = []
+    if not fields:
+        fields = ["keyword_in_the_text"]
+        if "wikipedia_title" in (system or ""):
+            fields.append("wikipedia_title")
+        elif "wikidata" in (system or "").lower():
+            fields.append("wikidata_id")
+
+    mentions = []
+    for match in re.finditer(r"\b[A-Z][\w'-]*(?:\s+[A-Z][\w'-]*)*", prompt):
+        mention = match.group(0)
+        if mention not in mentions:
+            mentions.append(mention)
+        if len(mentions) == max_keywords:
+            break
+
+    keywords = []
+    for mention in mentions:
+        keyword = {}
+        for field in fields:
+            if field == "wikidata_id":
+                keyword[field] = "Q" + str(int(prompt_hash(mention)[:6], 16))
+            else:
+                keyword[field] = mention
+        keywords.append(keyword)
+    return json.dumps({"keywords": keywords}, ensure_ascii=False)
+
+
+def tokenize(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class StandInState:
+    """
+    Configuration and counters of the stand-in server
+    """
+
+    def __init__(self, recordings=None, token_latency=0.0, load_time=0.0, failure_rate=0.0, seed=0,
+                 num_parallel=4, max_loaded=1):
+        self.recordings = recordings or {}
+        self.token_latency = token_latency
+        self.load_time = load_time
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.slots = threading.Semaphore(num_parallel)
+        self.max_loaded = max_loaded
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "failures": 0, "loads": 0, "tokens": 0, "cancelled": 0,
+                      "replayed": 0, "synthesized": 0}
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def load(self, model):
+        """
+        Load the model if needed, return the load time in seconds
+        """
+        with self.lock:
+            if model in self.loaded:
+                self.loaded.move_to_end(model)
+                return 0.0
+            self.loaded[model] = True
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+            self.stats["loads"] += 1
+        time.sleep(self.load_time)
+        return self.load_time
+
+    def answer(self, model, system, prompt, fmt):
+        recorded = self.recordings.get((model, prompt_hash(prompt)))
+        if recorded is not None:
+            self.count("replayed")
+            return recorded
+        self.count("synthesized")
+        return synthesize_answer(system, prompt, fmt)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.state.lock:
+                self._send_json(200, dict(self.state.stats, loaded=list(self.state.loaded)))
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": m} for m in sorted({m for m, _ in self.state.recordings})]})
+        elif self.path in ("/", "/api/version"):
+            self._send_json(200, {"version": "stand-in"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        state = self.state
+        state.count("requests")
+        if state.should_fail():
+            state.count("failures")
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        model = request.get("model", "")
+        prompt = request.get("prompt")
+        with state.slots:
+            start = time.monotonic()
+            load_seconds = state.load(model)
+
+            # an empty prompt only loads the model
+            if not prompt:
+                self._send_json(200, {"model": model, "response": "", "done": True, "done_reason": "load"})
+                return
+
+            system = request.get("system", "")
+            tokens = tokenize(state.answer(model, system, prompt, request.get("format")))
+            prompt_tokens = (len(system) + len(prompt)) // 4
+            prompt_seconds = prompt_tokens * state.token_latency / 10
+
+            time.sleep(prompt_seconds)
+            if request.get("stream", True):
+                self._stream(model, tokens, start, load_seconds, prompt_tokens, prompt_seconds)
+            else:
+                time.sleep(state.token_latency * len(tokens))
+                state.count("tokens", len(tokens))
+                final = self._final(model, start, load_seconds, prompt_tokens, prompt_seconds, len(tokens))
+                final["response"] = "".join(tokens)
+                self._send_json(200, final)
+
+    def _final(self, model, start, load_seconds, prompt_tokens, prompt_seconds, eval_count):
+        total = time.monotonic() - start
+        return {
+            "model": model,
+            "done": True,
+            "total_duration": int(total * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": eval_count,
+            "eval_duration": int(max(total - load_seconds - prompt_seconds, 0) * 1e9)
+        }
+
+    def _stream(self, model, tokens, start, load_seconds, prompt_tokens, prompt_seconds):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_chunk(data):
+            line = (json.dumps(data) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for i, token in enumerate(tokens):
+                time.sleep(self.state.token_latency)
+                write_chunk({"model": model, "response": token, "done": False})
+                self.state.count("tokens")
+            final = self._final(model, start, load_seconds, prompt_tokens, prompt_seconds, len(tokens))
+            final["response"] = ""
+            write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client closed the request: like Ollama, stop the generation
+            self.state.count("cancelled")
+            self.close_connection = True
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients that close the connection (e.g. stop_on_json) are normal, not errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """
+    Start a stand-in server in a background thread (port=0: a free port).
+    Return (server, base_url); stop it with server.shutdown()
+    """
+    server = StandInServer((host, port), StandInHandler)
+    server.state = StandInState(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic stand-in of the Ollama generate API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--recordings", help="JSONL of recorded completions (model, prompt or prompt_sha1, response)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per generated token")
+    parser.add_argument("--load-time", type=float, default=0.0, help="seconds to load a model")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests failing with HTTP 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--num-parallel", type=int, default=4)
+    parser.add_argument("--max-loaded", type=int, default=1, help="models kept loaded at the same time")
+    args = parser.parse_args()
+
+    server = StandInServer((args.host, args.port), StandInHandler)
+    server.state = StandInState(load_recordings(args.recordings), args.token_latency, args.load_time,
+                                args.failure_rate, args.seed, args.num_parallel, args.max_loaded)
+    print(f"Stand-in di Ollama su http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,51 @@
+"""
+Build the index of offline_titles.py from the tiny dumps of this folder and check the QIDs of the lookups:
+an article, a redirect chain, a page outside namespace 0, an interwiki redirect and titles with escaped quotes.
+
+python fixtures/offline_titles/check_offline_titles.py
+"""
+
+import os
+import sys
+import tempfile
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(FOLDER, "..", ".."))
+from offline_titles import build_index, TitleIndex
+
+EXPECTED = {
+    "Alps": "Q1286",
+    "alps": "Q1286",                # first letter as saved by MediaWiki
+    " Rome ": "Q220",
+    "The Alps": "Q1286",            # redirect
+    "Alpine mountains": "Q1286",    # redirect -> redirect -> article
+    "Don't (song)": "Q42",          # \' in the dump
+    '"Quoted" title': "Q99",        # \" in the dump
+    "Città": "Q7",
+    "Talk only": None,              # namespace 1
+    "Interwiki redirect": None,     # redirect to another wiki
+    "Without qid": None,            # article without wikibase_item
+    "Missing": None,
+    None: None,
+}
+
+
+def check():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "enwiki.idx")
+        size = build_index(os.path.join(FOLDER, "page.sql"), os.path.join(FOLDER, "redirect.sql"),
+                           os.path.join(FOLDER, "page_props.sql"), path)
+        index = TitleIndex(path)
+        try:
+            assert size == 7, f"{size} titoli nell'indice invece di 7"
+            errors = [(title, index.get(title), qid) for title, qid in EXPECTED.items() if index.get(title) != qid]
+        finally:
+            index.close()
+    for title, found, qid in errors:
+        print(f"{title!r}: {found} invece di {qid}")
+    assert not errors, f"{len(errors)} lookup errati"
+    print(f"OK: {len(EXPECTED)} lookup")
+
+
+if __name__ == "__main__":
+    check()
@@ -0,0 +1,12 @@
+-- Tiny `page` dump for check_offline_titles.py
+CREATE TABLE `page` (
+  `page_id` int(8) unsigned NOT NULL AUTO_INCREMENT,
+  `page_namespace` int(11) NOT NULL DEFAULT 0,
+  `page_title` varbinary(255) NOT NULL DEFAULT '',
+  `page_is_redirect` tinyint(1) unsigned NOT NULL DEFAULT 0,
+  `page_is_new` tinyint(1) unsigned NOT NULL DEFAULT 0,
+  `page_random` double unsigned NOT NULL DEFAULT 0,
+  PRIMARY KEY (`page_id`)
+) ENGINE=InnoDB;
+INSERT INTO `page` VALUES (1,0,'Alps',0,0,0.1),(2,0,'Rome',0,0,0.2),(3,0,'The_Alps',1,0,0.3),(4,1,'Talk_only',0,0,0.4),(5,0,'Alpine_mountains',1,0,0.5),(6,0,'Don\'t_(song)',0,0,0.6);
+INSERT INTO `page` VALUES (7,0,'Interwiki_redirect',1,0,0.7),(8,0,'Without_qid',0,0,0.8),(9,0,'Città',0,0,0.9),(10,0,'\"Quoted\"_title',0,0,0.1);
@@ -0,0 +1,9 @@
+-- Tiny `page_props` dump for check_offline_titles.py
+CREATE TABLE `page_props` (
+  `pp_page` int(10) unsigned NOT NULL,
+  `pp_propname` varbinary(60) NOT NULL,
+  `pp_value` blob NOT NULL,
+  `pp_sortkey` float DEFAULT NULL,
+  PRIMARY KEY (`pp_page`,`pp_propname`)
+) ENGINE=InnoDB;
+INSERT INTO `page_props` VALUES (1,'wikibase_item','Q1286',NULL),(2,'wikibase_item','Q220',NULL),(2,'page_image_free','Rome (it\'s).jpg',NULL),(4,'wikibase_item','Q9',NULL),(6,'wikibase_item','Q42',NULL),(9,'wikibase_item','Q7',NULL),(10,'wikibase_item','Q99',NULL);
@@ -0,0 +1,10 @@
+-- Tiny `redirect` dump for check_offline_titles.py
+CREATE TABLE `redirect` (
+  `rd_from` int(8) unsigned NOT NULL DEFAULT 0,
+  `rd_namespace` int(11) NOT NULL DEFAULT 0,
+  `rd_title` varbinary(255) NOT NULL DEFAULT '',
+  `rd_interwiki` varbinary(32) DEFAULT NULL,
+  `rd_fragment` varbinary(255) DEFAULT NULL,
+  PRIMARY KEY (`rd_from`)
+) ENGINE=InnoDB;
+INSERT INTO `redirect` VALUES (3,0,'Alps','',NULL),(5,0,'The_Alps','','Geography'),(7,0,'Rome','en',NULL);
@@ -0,0 +1,56 @@
+"""
+Resolve the DBpedia URIs and the labels of dbpedia.nt with sparql_batch.py on the stand-in endpoint of
+sparql_stand_in.py and check the QIDs: non-ASCII IRIs, an apostrophe and parentheses in an IRI,
+a quote in a label, a resource without a Wikidata link and the split of the batches refused by the endpoint.
+
+python fixtures/sparql_batch/check_sparql_batch.py
+"""
+
+import os
+import sys
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(FOLDER, "..", ".."))
+from sparql_batch import BatchSparqlResolver
+from sparql_stand_in import start_server, load_ntriples
+
+RESOURCE = "http://dbpedia.org/resource/"
+EXPECTED_URIS = {
+    RESOURCE + "Alps": "Q1286",
+    RESOURCE + "Zürich": "Q72",
+    RESOURCE + "Aosta_Valley": "Q1222",
+    RESOURCE + "Valle_d'Aosta_(disambiguation)": "Q3554025",
+    RESOURCE + "Città_di_Castello": "Q19968",
+    RESOURCE + "Without_link": None,
+    RESOURCE + "Missing": None,
+}
+EXPECTED_LABELS = {
+    "Alps": "Q1286",
+    "Zürich": "Q72",
+    "Città di Castello": "Q19968",
+    'L\'Aquila "Valle"': "Q3554025",
+    "Missing": None,
+}
+
+
+def check():
+    # more than 3 values in a query: HTTP 500, the batches are split
+    server, endpoint = start_server(triples=load_ntriples(os.path.join(FOLDER, "dbpedia.nt")), max_values=3)
+    try:
+        resolver = BatchSparqlResolver(endpoint, batch_size=50)
+        found = resolver.dbpedia_to_wikidata(list(EXPECTED_URIS))
+        found.update(resolver.labels_to_wikidata(list(EXPECTED_LABELS)))
+    finally:
+        server.shutdown()
+
+    expected = {**EXPECTED_URIS, **EXPECTED_LABELS}
+    errors = [(key, found.get(key, "assente"), qid) for key, qid in expected.items() if found.get(key, "assente") != qid]
+    for key, value, qid in errors:
+        print(f"{key!r}: {value} invece di {qid}")
+    assert not errors, f"{len(errors)} risultati errati"
+    assert resolver.stats["splits"] > 0 and not resolver.stats["failed"], resolver.stats
+    print(f"OK: {len(expected)} valori, {resolver.stats}")
+
+
+if __name__ == "__main__":
+    check()
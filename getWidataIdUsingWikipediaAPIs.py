@@ -1,9 +1,14 @@
+from requests.adapters import HTTPAdapter
 import requests
 import os
 import json
+import logging
+from qid_cache import QidCache
+from offline_titles import load_index
+from rate_limit import LimitedSession, print_report
 
 # Use Wikipedia APIs to find Wikidata QID from a Wikipedia title
-def get_wikidata_entity_from_wikipedia_title(language, title):
+def get_wikidata_entity_from_wikipedia_title(language, title, session=None):
     
     url = f"https://{language}.wikipedia.org/w/api.php"
     
@@ -17,7 +22,9 @@ def get_wikidata_entity_from_wikipedia_title(language, title):
     }
     
     # HTTP GET to WIkipedia APIs
-    response = requests.get(url, params=params)
+    if session is None:
+        session = make_session(1)
+    response = session.get(url, params=params)
     
     data = response.json()
     
@@ -32,10 +39,120 @@ def get_wikidata_entity_from_wikipedia_title(language, title):
         return None  
 
 
+# Pooled session for the Wikipedia APIs, with the shared rate limiter of rate_limit.py (maxlag, Retry-After)
+def make_session(pool_size=4):
+    session = LimitedSession()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Use Wikipedia APIs to find the Wikidata QIDs of many Wikipedia titles, 50 titles per request.
+# Return {title: QID or None}, with the same result of get_wikidata_entity_from_wikipedia_title for each title;
+# the titles of a failed request (HTTP error, MediaWiki error such as maxlag) are left out, so they are not cached.
+# The titles already in `cache` (a dict updated with the new results) are not requested again,
+# with a QidCache (qid_cache.py) the titles resolved in the previous runs too.
+# With offline_folder the titles are resolved without the APIs, with the index of offline_titles.py.
+def get_wikidata_entities_from_wikipedia_titles(language, titles, session=None, batch_size=50, cache=None, qid_cache=None,
+                                                offline_folder=None):
+    
+    url = f"https://{language}.wikipedia.org/w/api.php"
+    results = {} if cache is None else cache
+    pending = [title for title in dict.fromkeys(titles) if title and title not in results]
+    
+    if offline_folder is not None:
+        results.update(load_index(language, offline_folder).get_many(pending))
+        return results
+    
+    if qid_cache is not None and pending:
+        results.update(qid_cache.resolve_many(f"wikipedia:{language}", pending,
+                                              lambda missing: get_wikidata_entities_from_wikipedia_titles(
+                                                  language, missing, session, batch_size)))
+        return results
+    
+    if session is None:
+        session = make_session()
+    
+    # a "|" would split the title in more titles: these titles are requested one by one, as before
+    for title in [title for title in pending if "|" in title]:
+        results[title] = get_wikidata_entity_from_wikipedia_title(language, title, session)
+    pending = [title for title in pending if "|" not in title]
+    
+    for i in range(0, len(pending), batch_size):
+        chunk = pending[i:i + batch_size]
+        params = {
+            "action": "query",
+            "prop": "pageprops",
+            "titles": "|".join(chunk),
+            "format": "json",
+            "redirects": 1
+        }
+        
+        # the answer can be split in more parts (continue)
+        sections = {"normalized": {}, "converted": {}, "redirects": {}}
+        pages = {}
+        continue_params = {}
+        failed = False
+        while True:
+            try:
+                response = session.post(url, data={**params, **continue_params})
+                response.raise_for_status()
+                data = response.json()
+            except (requests.RequestException, ValueError) as e:
+                data = {"error": {"info": str(e)}}
+            if "error" in data or "query" not in data:
+                logging.error(f"Wikipedia API: {len(chunk)} titoli non risolti: {data.get('error')}")
+                failed = True
+                break
+            query = data["query"]
+            for section, mapping in sections.items():
+                for entry in query.get(section, []):
+                    mapping[entry["from"]] = entry["to"]
+            for page_id, page in query.get("pages", {}).items():
+                pages.setdefault(page_id, {}).update(page)
+            if "continue" not in data:
+                break
+            continue_params = data["continue"]
+        if failed:
+            continue
+        
+        by_title = {page["title"]: page for page in pages.values() if "title" in page}
+        for title in chunk:
+            # requested title -> normalized title -> converted title -> target of the redirects
+            target = sections["normalized"].get(title, title)
+            target = sections["converted"].get(target, target)
+            seen = set()
+            while target in sections["redirects"] and target not in seen:
+                seen.add(target)
+                target = sections["redirects"][target]
+            
+            page = by_title.get(target, {})
+            results[title] = page.get("pageprops", {}).get("wikibase_item")
+    
+    return results
+
+
+# Unique Wikipedia titles of the keywords of a JSON file (LLMs answers)
+def collect_titles(input_json):
+    titles = []
+    for item in input_json:
+        for entity in item.get("keywords", []) if isinstance(item, dict) else []:
+            wikipedia_label = entity.get("wikipedia_title") if isinstance(entity, dict) else None
+            if wikipedia_label and isinstance(wikipedia_label, str):
+                titles.append(wikipedia_label)
+    return list(dict.fromkeys(titles))
+
+
 # Elaborate the JSON file (LLMs answers)
-def process_json(input_json, language='en'):
+# `resolved` is {title: QID} of get_wikidata_entities_from_wikipedia_titles (computed for the file if None)
+def process_json(input_json, language='en', resolved=None, session=None, qid_cache=None, offline_folder=None):
     output_json = []  
     
+    if resolved is None:
+        resolved = get_wikidata_entities_from_wikipedia_titles(language, collect_titles(input_json), session,
+                                                               qid_cache=qid_cache, offline_folder=offline_folder)
+    
     # for each object in the JSON
     for item in input_json:
         new_item = {"keywords": []}  # new object to populate
@@ -49,8 +166,13 @@ def process_json(input_json, language='en'):
                 
                 if wikipedia_label:  # checks if the key "wikipedia_title" exists
                     
-                    # call Wikipedia APIs to find Wikidata QID
-                    wikidata_id = get_wikidata_entity_from_wikipedia_title(language, wikipedia_label)
+                    # Wikidata QID found with the Wikipedia APIs
+                    if isinstance(wikipedia_label, str):
+                        wikidata_id = resolved.get(wikipedia_label)
+                    elif offline_folder is not None:
+                        wikidata_id = None
+                    else:
+                        wikidata_id = get_wikidata_entity_from_wikipedia_title(language, wikipedia_label, session)
                     
                     if wikidata_id: 
                         new_item["keywords"].append({
@@ -77,28 +199,46 @@ def save_json_to_file(output_data, output_path):
         json.dump(output_data, file, indent=4, ensure_ascii=False)
 
 #Elaborate all the JSON files (LLMs answers) in a folder
-def process_all_json_files(input_folder, output_folder, language='en'):
+def process_all_json_files(input_folder, output_folder, language='en', qid_cache=None, offline_folder=None):
     # Get all JSON in the input folder
+    input_jsons = {}
     for filename in os.listdir(input_folder):
         if filename.endswith(".json"):
             
             input_file_path = os.path.join(input_folder, filename)
-            output_file_path = os.path.join(output_folder, filename)  
             
             # read a JSON file input
             try:
-                input_json = read_json_from_file(input_file_path)
+                input_jsons[filename] = read_json_from_file(input_file_path)
             except json.JSONDecodeError:
                 print(f"Errore nella lettura di {filename}. File JSON non valido.")
                 continue
-            
-            # Elaborate the JSON file to get the ID Wikidata
-            output_json = process_json(input_json, language)
-            
-            # Save results in the output JSON file
-            save_json_to_file(output_json, output_file_path)
-            print(f"Elaborato {filename} e salvato come {filename}")
+    
+    # the titles of all the files are resolved together, 50 per request
+    titles = list(dict.fromkeys(title for input_json in input_jsons.values() for title in collect_titles(input_json)))
+    resolved = get_wikidata_entities_from_wikipedia_titles(language, titles, make_session(), qid_cache=qid_cache,
+                                                           offline_folder=offline_folder)
+    if offline_folder is not None:
+        print(f"{len(titles)} titoli Wikipedia risolti offline")
+    elif qid_cache is not None:
+        print(f"Cache QID: {qid_cache.stats()}")
+        print_report()
+    else:
+        print(f"{len(titles)} titoli Wikipedia risolti con {-(-len(titles) // 50)} richieste")
+        print_report()
+    
+    for filename, input_json in input_jsons.items():
+        output_file_path = os.path.join(output_folder, filename)  
+        
+        # Elaborate the JSON file to get the ID Wikidata
+        output_json = process_json(input_json, language, resolved, offline_folder=offline_folder)
+        
+        # Save results in the output JSON file
+        save_json_to_file(output_json, output_file_path)
+        print(f"Elaborato {filename} e salvato come {filename}")
 
 
 
-process_all_json_files("folder_with_an_LLM_JSONanswers", "otuptu_folder", language='en')
\ No newline at end of file
+if __name__ == "__main__":
+    # offline_folder="offline" to use the index built with offline_titles.py instead of the APIs
+    process_all_json_files("folder_with_an_LLM_JSONanswers", "otuptu_folder", language='en', qid_cache=QidCache())
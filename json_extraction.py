@@ -0,0 +1,261 @@
+"""
+Incremental scanner of the JSON objects in the answer of an LLM.
+
+The scanner reads the answer piece by piece (e.g. the tokens streamed by Ollama), skips the
+<think>...</think> reasoning blocks and the string literals, and returns the spans of the balanced
+top-level {...} objects as soon as they are closed. KeywordsJsonDetector uses it to stop the
+generation when the {"keywords": [...]} object is complete, estrai_json_da_stringa() uses it to
+find the json in a whole answer: a strict parse first, json_repair only when nothing else works.
+"""
+
+import json
+import logging
+import re
+
+def keywords_schema(id_field=None):
+    """
+    JSON schema of the answer asked by the prompts, for the structured output (`format`) of Ollama:
+    {"keywords": [{"keyword_in_the_text": ..., <id_field>: ...}]}.
+    id_field is "wikidata_id" (prompt 1), None (prompt 2, only the mentions) or "wikipedia_title" (prompt 3)
+    """
+    properties = {"keyword_in_the_text": {"type": "string"}}
+    if id_field:
+        properties[id_field] = {"type": "string"}
+    return {
+        "type": "object",
+        "properties": {
+            "keywords": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": list(properties)
+                }
+            }
+        },
+        "required": ["keywords"]
+    }
+
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+class JsonSpanScanner:
+    """
+    Single-pass, brace-balanced scanner of the top-level JSON objects of a text
+    """
+
+    def __init__(self, skip_think=True):
+        self.skip_think = skip_think
+        self.buffer = ""
+        self.spans = []          # (start, end) of the closed top-level objects
+        self.think_end = None    # position of the end of the first </think>
+        self._pos = 0
+        self._depth = 0
+        self._start = None
+        self._in_string = False
+        self._escape = False
+        self._in_think = False
+
+    def _tag_at(self, tag):
+        """
+        True if the tag starts at the current position, None if the buffer ends with a part of it
+        """
+        fragment = self.buffer[self._pos:self._pos + len(tag)]
+        if fragment == tag:
+            return True
+        if len(fragment) < len(tag) and tag.startswith(fragment):
+            return None
+        return False
+
+    def feed(self, text):
+        """
+        Add a piece of text, return the spans of the objects closed by it
+        """
+        self.buffer += text
+        new_spans = []
+        buffer = self.buffer
+        n = len(buffer)
+
+        while self._pos < n:
+            c = buffer[self._pos]
+
+            if self._in_think:
+                if c == "<":
+                    found = self._tag_at(THINK_CLOSE)
+                    if found is None:
+                        break            # wait for the rest of the tag
+                    if found:
+                        self._in_think = False
+                        self._pos += len(THINK_CLOSE)
+                        if self.think_end is None:
+                            self.think_end = self._pos
+                        continue
+                self._pos += 1
+
+            elif self._depth == 0:
+                if c == "{":
+                    self._depth = 1
+                    self._start = self._pos
+                elif c == "<" and self.skip_think:
+                    found = self._tag_at(THINK_OPEN)
+                    if found is None:
+                        break
+                    if found:
+                        self._in_think = True
+                        self._pos += len(THINK_OPEN)
+                        continue
+                self._pos += 1
+
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                self._pos += 1
+
+            else:
+                if c == '"':
+                    self._in_string = True
+                elif c == "{":
+                    self._depth += 1
+                elif c == "}":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        span = (self._start, self._pos + 1)
+                        self.spans.append(span)
+                        new_spans.append(span)
+                        self._start = None
+                self._pos += 1
+
+        return new_spans
+
+    @property
+    def in_think(self):
+        return self._in_think
+
+    def text(self, span):
+        return self.buffer[span[0]:span[1]]
+
+
+class KeywordsJsonDetector:
+    """
+    Recognise when the {"keywords": [...]} object of the answer is closed
+    """
+
+    def __init__(self, key="keywords"):
+        self.key = '"' + key + '"'
+        self.scanner = JsonSpanScanner()
+        self.tokens = 0
+        self.think_end_token = None   # index of the token that closed the reasoning block
+        self.span = None
+
+    @property
+    def done(self):
+        return self.span is not None
+
+    def feed(self, token):
+        """
+        Add a token of the answer, return True when the keywords object is complete
+        """
+        self.tokens += 1
+        had_think_end = self.scanner.think_end is not None
+        for span in self.scanner.feed(token):
+            if self.key in self.scanner.text(span):
+                self.span = span
+                break
+        if not had_think_end and self.scanner.think_end is not None:
+            self.think_end_token = self.tokens
+        return self.done
+
+    @property
+    def text(self):
+        return self.scanner.buffer
+
+
+def iter_json_candidates(stringa):
+    """
+    Return the candidate json strings of an answer: the balanced top-level objects outside
+    the <think> blocks and an object left open by a truncated answer after them, the ones
+    with "keywords" first.
+    """
+    scanner = JsonSpanScanner()
+    scanner.feed(stringa)
+
+    # a reasoning block never closed: look for the json inside it
+    if not scanner.spans and scanner.in_think:
+        scanner = JsonSpanScanner(skip_think=False)
+        scanner.feed(stringa)
+
+    texts = [scanner.text(span) for span in scanner.spans]
+    if scanner._start is not None:
+        texts.append(scanner.buffer[scanner._start:])
+    return [t for t in texts if '"keywords"' in t] + [t for t in texts if '"keywords"' not in t]
+
+
+def _count(stats, key):
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + 1
+
+
+def estrai_json_da_stringa(stringa, percorso_file_json, stats=None):
+    """
+    extract the json from a string (from an LLM's answer).
+    `stats` (optional dict) counts how the json has been obtained:
+    strict, cleaned (trailing commas removed), repaired (json_repair), failed, no_json
+    """
+    candidates = iter_json_candidates(stringa)
+    if not candidates:
+        logging.error(f"Nessun JSON valido trovato nella stringa: {stringa}")
+        _count(stats, "no_json")
+        return None
+
+    # the other objects of the answer (e.g. an example in the text) only when no candidate has "keywords"
+    keywords_candidates = [candidate for candidate in candidates if '"keywords"' in candidate]
+    return _parse_candidates(keywords_candidates or candidates, percorso_file_json, stats)
+
+
+def _parse_candidates(candidates, percorso_file_json, stats=None):
+    """
+    The first candidate parsed as it is, then without trailing commas, then repaired (the first one)
+    """
+    # fast path: strict parse
+    for candidate in candidates:
+        try:
+            parsed = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict):
+            _count(stats, "strict")
+            return parsed
+
+    # removes punctuation marks (trailing commas)
+    cleaned = [re.sub(r',\s*(\}|\])', r'\1', candidate) for candidate in candidates]
+    for candidate in cleaned:
+        try:
+            parsed = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict):
+            _count(stats, "cleaned")
+            return parsed
+
+    # slow path: repair the best candidate
+    from json_repair import repair_json
+    try:
+        parsed = json.loads(repair_json(cleaned[0]))
+        if not isinstance(parsed, dict):
+            raise ValueError("il json riparato non e' un oggetto")
+    except Exception as e:
+        logging.error(f"Errore nel JSON: {percorso_file_json} - json Nemmeno riparato ({e})\n"
+                      f"Stringa problematica: {cleaned[0]}")
+        _count(stats, "failed")
+        return None
+
+    logging.error(f"Errore nel JSON: {percorso_file_json} - json riparato e inserito nel file\n"
+                  f"Stringa problematica: {cleaned[0]}")
+    _count(stats, "repaired")
+    return parsed
@@ -0,0 +1,193 @@
+"""
+Local index of the Wikidata labels and aliases, to resolve the mentions of approach 2 without the
+SPARQL endpoint.
+
+The index is built from the JSON dump of Wikidata (https://dumps.wikimedia.org/wikidatawiki/entities/,
+latest-all.json.gz or .bz2, or a subset of it with the same format: one entity per line) and saved in
+a SQLite file with the labels and the aliases of the items in the chosen languages and their number of
+sitelinks. A mention can be looked up as it is (exact), case folded or as a prefix; the candidate QIDs
+are ranked by: label before alias, then number of sitelinks.
+
+python label_index.py build latest-all.json.gz --languages en --min-sitelinks 1
+python label_index.py lookup "value chain" --mode casefold
+
+LocalLabelResolver (name "labels" in resolvers.RESOLVERS) resolves the "keyword_in_the_text" field
+like SparqlLabelResolver, so `python linking_pipeline.py resolve labels` writes the originalKey /
+original_value / Wikidata_ID output read by evaluation.py.
+"""
+
+import argparse
+import bz2
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+
+DEFAULT_PATH = os.path.join("offline", "labels.sqlite")
+MODES = ("exact", "casefold", "prefix")
+
+
+def fold(text):
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith(".bz2"):
+        return bz2.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_dump_entities(path):
+    """
+    Entities of a Wikidata JSON dump (a json array with one entity per line)
+    """
+    with _open_dump(path) as file:
+        for line in file:
+            line = line.strip().rstrip(",")
+            if not line or line in ("[", "]"):
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def entity_rows(entity, languages):
+    """
+    (label, folded label, qid number, is_alias, sitelinks) of the labels and aliases of an item
+    """
+    if entity.get("type") != "item" or not re.fullmatch(r"Q\d+", entity.get("id", "")):
+        return []
+    qid = int(entity["id"][1:])
+    sitelinks = len(entity.get("sitelinks") or {})
+    rows = []
+    seen = set()
+    for language in languages:
+        names = []
+        label = (entity.get("labels") or {}).get(language)
+        if label:
+            names.append((label["value"], 0))
+        names += [(alias["value"], 1) for alias in (entity.get("aliases") or {}).get(language, [])]
+        for name, is_alias in names:
+            if name and name not in seen:
+                seen.add(name)
+                rows.append((name, fold(name), qid, is_alias, sitelinks))
+    return rows
+
+
+def build_index(dump_path, output=DEFAULT_PATH, languages=("en",), min_sitelinks=0, limit=None, batch_size=10000):
+    """
+    Write the labels and aliases of the items of the dump in a new index. Return the number of items
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_path = output + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    connection.execute("CREATE TABLE labels (label TEXT NOT NULL, folded TEXT NOT NULL, qid INTEGER NOT NULL, "
+                       "is_alias INTEGER NOT NULL, sitelinks INTEGER NOT NULL)")
+
+    start = time.monotonic()
+    items = 0
+    batch = []
+    for entity in iter_dump_entities(dump_path):
+        if len(entity.get("sitelinks") or {}) < min_sitelinks:
+            continue
+        rows = entity_rows(entity, languages)
+        if not rows:
+            continue
+        batch += rows
+        items += 1
+        if len(batch) >= batch_size:
+            connection.executemany("INSERT INTO labels VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+        if items % 1000000 == 0:
+            print(f"{items} item ({time.monotonic() - start:.0f}s)")
+        if limit and items >= limit:
+            break
+    connection.executemany("INSERT INTO labels VALUES (?, ?, ?, ?, ?)", batch)
+
+    # the indexes are created at the end, faster than during the inserts
+    connection.execute("CREATE INDEX labels_label ON labels (label)")
+    connection.execute("CREATE INDEX labels_folded ON labels (folded)")
+    connection.commit()
+    connection.close()
+    os.replace(tmp_path, output)
+    print(f"{items} item indicizzati in {output} ({time.monotonic() - start:.0f}s)")
+    return items
+
+
+class LabelIndex:
+    """
+    Read-only lookup of the index built by build_index
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Indice delle label non trovato: {path} (python label_index.py build ...)")
+        self.path = path
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def lookup(self, mention, mode="exact", limit=5):
+        """
+        Candidates [(QID, label, sitelinks)] of a mention, the best first
+        """
+        if mode == "exact":
+            where, params = "label = ?", (mention,)
+        elif mode == "casefold":
+            where, params = "folded = ?", (fold(mention),)
+        elif mode == "prefix":
+            prefix = fold(mention)
+            if not prefix:
+                return []
+            # the folded labels between prefix and prefix + the last unicode character
+            where, params = "folded >= ? AND folded < ?", (prefix, prefix + "\U0010ffff")
+        else:
+            raise ValueError(f"Modalita' '{mode}' non riconosciuta, usa una di {MODES}")
+
+        rows = self.connection.execute(
+            f"SELECT qid, label, sitelinks, MIN(is_alias) AS alias FROM labels WHERE {where} "
+            f"GROUP BY qid ORDER BY alias, sitelinks DESC, qid LIMIT ?", (*params, limit)).fetchall()
+        return [(f"Q{qid}", label, sitelinks) for qid, label, sitelinks, _ in rows]
+
+    def best(self, mention, modes=("exact", "casefold")):
+        """
+        Best QID of a mention with the first mode that finds something, None if not found
+        """
+        for mode in modes:
+            candidates = self.lookup(mention, mode, limit=1)
+            if candidates:
+                return candidates[0][0]
+        return None
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local index of the Wikidata labels and aliases")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="build the index from a Wikidata JSON dump")
+    build_parser.add_argument("dump", help="latest-all.json(.gz|.bz2) or a subset with one entity per line")
+    build_parser.add_argument("--languages", nargs="+", default=["en"])
+    build_parser.add_argument("--min-sitelinks", type=int, default=0, help="skip the items with fewer sitelinks")
+    build_parser.add_argument("--limit", type=int, help="stop after this number of items")
+    build_parser.add_argument("--output", default=DEFAULT_PATH)
+
+    lookup_parser = subparsers.add_parser("lookup", help="candidate QIDs of a mention")
+    lookup_parser.add_argument("mention")
+    lookup_parser.add_argument("--mode", choices=MODES, default="exact")
+    lookup_parser.add_argument("--limit", type=int, default=5)
+    lookup_parser.add_argument("--index", default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.dump, args.output, args.languages, args.min_sitelinks, args.limit)
+    else:
+        for qid, label, sitelinks in LabelIndex(args.index).lookup(args.mention, args.mode, args.limit):
+            print(f"{qid}\t{label}\t{sitelinks} sitelink")
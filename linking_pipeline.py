@@ -0,0 +1,150 @@
+"""
+One LLM pass, several linking strategies.
+
+Approaches 2 and 3 of the README both start from the mentions found by the LLM. Here a single
+extraction pass (one prompt asking for the mention, its Wikipedia title and, if known, its Wikidata ID)
+is saved in a result store, and then every resolver of resolvers.py links the same mention set:
+
+    python linking_pipeline.py extract                   LLM pass -> mentions/results.jsonl
+    python linking_pipeline.py resolve wikipedia sparql qid
+    python linking_pipeline.py resolve labels            with the local index of label_index.py
+
+The output of each resolver is <output_folder>/<resolver>/<model>/<file>.csv.json, with the
+originalKey / original_value / Wikidata_ID fields read by evaluation.py.
+"""
+
+import argparse
+import os
+
+import ollama
+from resolvers import RESOLVERS, DEFAULT_RESOLVERS
+from qid_cache import QidCache
+from rate_limit import print_report
+from result_store import read_records, prompt_id, save_json_atomic
+
+# shared prompt of the extraction pass (prompt 3 with the optional Wikidata ID)
+mentionPrompt = """
+###keyword's definition 
+A keyword is a key element extracted from texts. There are four distinct roles for the keywords: (1) terminology, referring to specialized lexical items within a specific domain; (2) topics, encompassing terms and labels within systematic concept systems like knowledge bases, such as Wikidata; (3) index terms, which highlight major concepts, events, or individuals, including named entities; and (4) summary terms, designed to provide a concise description of the content.
+
+###request
+Basing on the provided keyword's definition, recognize the keywords in the text and, for each of them, find the exact title corresponding to the Wikipedia page and, if you know it, the Wikidata ID. The final result should be a json like this:
+
+### Json
+    {
+        "keywords": [
+            {
+                "keyword_in_the_text": "...",
+                "wikipedia_title": "...",
+                "wikidata_id": "..."
+            },
+            {
+                "keyword_in_the_text": "...",
+                "wikipedia_title": "...",
+                "wikidata_id": "..."
+            }
+            ...
+        ]
+    }
+
+Answer only with the json
+"""
+
+mentions_store = "mentions/results.jsonl"
+mentions_folder = "mentions"
+output_folder = "linked"
+
+
+def extract_mentions(models):
+    """
+    The single LLM pass: mentions of all the narratives for every model
+    """
+    ollama.run_models(models, mentionPrompt, "wikipedia_title", mentions_store, mentions_folder)
+
+
+def load_mentions(store_path, prompt=None):
+    """
+    {(model, narrative): {row: item}} from the store of the extraction pass (the last record of a row wins)
+    """
+    grouped = {}
+    for record in read_records(store_path):
+        if prompt is not None and record.get("prompt") != prompt:
+            continue
+        grouped.setdefault((record["model"], record["narrative"]), {})[record["row"]] = record["item"]
+    return grouped
+
+
+def link_items(items, resolver):
+    """
+    Resolve the mentions of a list of items with a resolver, in the format of getWidataIdUsingWikipediaAPIs.process_json
+    """
+    values = [entity.get(resolver.field) for item in items for entity in item.get("keywords", [])
+              if isinstance(entity, dict) and entity.get(resolver.field)
+              and not isinstance(entity.get(resolver.field), (list, dict))]
+    resolved = resolver.resolve_many(values) if values else {}
+
+    output = []
+    for item in items:
+        new_item = {"keywords": []}
+        for entity in item.get("keywords", []):
+            if not isinstance(entity, dict):
+                continue
+            value = entity.get(resolver.field)
+            # the lists and objects of malformed answers are not resolved
+            wikidata_id = resolved.get(value) if value and not isinstance(value, (list, dict)) else None
+            if wikidata_id:
+                new_item["keywords"].append({
+                    "originalKey": entity.get("keyword_in_the_text"),
+                    "original_value": value,
+                    "Wikidata_ID": wikidata_id
+                })
+        output.append(new_item)
+    return output
+
+
+def resolve_mentions(resolver_names, store_path=mentions_store, output_folder=output_folder, prompt=None):
+    """
+    Apply every resolver to the saved mention set
+    """
+    grouped = load_mentions(store_path, prompt)
+    qid_cache = QidCache()
+    for name in resolver_names:
+        try:
+            resolver = RESOLVERS[name](qid_cache=qid_cache)
+        except FileNotFoundError as e:
+            # e.g. the local label index not built yet
+            print(f"Resolver {name} saltato: {e}")
+            continue
+        for (model, narrative), rows in sorted(grouped.items()):
+            items = [rows[row] for row in sorted(rows)]
+            folder = os.path.join(output_folder, name, model)
+            os.makedirs(folder, exist_ok=True)
+            save_json_atomic(link_items(items, resolver), os.path.join(folder, narrative + ".json"))
+        print(f"Resolver {name}: {len(grouped)} file in {os.path.join(output_folder, name)}")
+    print(f"Cache QID: {qid_cache.stats()}")
+    print_report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared mention extraction and pluggable linking")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = subparsers.add_parser("extract", help="LLM pass over the narratives")
+    extract_parser.add_argument("--model", action="append", help="model (repeatable, default: ollama.listllms)")
+
+    resolve_parser = subparsers.add_parser("resolve", help="link the saved mentions")
+    resolve_parser.add_argument("resolvers", nargs="*", default=DEFAULT_RESOLVERS,
+                                help=f"any of {', '.join(RESOLVERS)} (default: {' '.join(DEFAULT_RESOLVERS)})")
+    resolve_parser.add_argument("--output", default=output_folder)
+    args = parser.parse_args()
+    # argparse checks the list default against choices, so the names are checked here
+    if args.command == "resolve":
+        unknown = [name for name in args.resolvers if name not in RESOLVERS]
+        if unknown:
+            resolve_parser.error(f"resolver sconosciuti: {', '.join(unknown)} (disponibili: {', '.join(RESOLVERS)})")
+    ollama.setup_logging()
+
+    if args.command == "extract":
+        extract_mentions(args.model or ollama.listllms)
+    else:
+        resolve_mentions(args.resolvers, output_folder=args.output, prompt=prompt_id(mentionPrompt))
@@ -0,0 +1,261 @@
+"""
+Long-lived client for the Ollama generate API (https://github.com/ollama/ollama/blob/main/docs/api.md).
+
+One client is created per model and reused for every narrative row: it keeps a
+persistent HTTP session and asks Ollama to keep the model loaded between calls.
+With a ResponseCache (response_cache.py) the answers already generated are not requested again.
+With stop_on_json the answer is streamed and, once the {"keywords": [...]} object is complete, the
+stream is read for at most drain_chunks more chunks to get the final message of Ollama (token counts
+and durations); if it does not come, the request is closed and Ollama stops the generation when the
+client disconnects (an early stop: only the streamed tokens and the time to first token are known).
+With `format` (a JSON schema, see json_extraction.keywords_schema) the answer is constrained at
+decode time by the structured output of Ollama.
+With num_ctx="auto" the context window is sized for each call (see choose_num_ctx).
+With a MetricsWriter (telemetry.py) the timing metadata of every call is saved.
+Connection errors and HTTP 5xx answers are retried max_retries times with exponential backoff.
+"""
+
+import json
+import logging
+import math
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from json_extraction import KeywordsJsonDetector
+
+
+# context sizes used with num_ctx="auto": few buckets, so Ollama does not reload the model at every call
+CTX_BUCKETS = (2048, 4096, 8192, 16384)
+
+
+def estimate_tokens(text, chars_per_token=3.0):
+    """
+    Rough (pessimistic) number of tokens of a text
+    """
+    return math.ceil(len(text) / chars_per_token)
+
+
+def choose_num_ctx(system, prompt, output_budget=1024, buckets=CTX_BUCKETS, chars_per_token=3.0):
+    """
+    Smallest context bucket that holds the system prompt, the text and the expected answer.
+    Return (num_ctx, needed_tokens); when even the largest bucket is too small the text
+    will be truncated by Ollama, and a warning is logged.
+    """
+    # ~32 tokens for the chat template
+    needed = estimate_tokens(system, chars_per_token) + estimate_tokens(prompt, chars_per_token) + 32 + output_budget
+    for size in buckets:
+        if needed <= size:
+            return size, needed
+    logging.warning(f"Contesto insufficiente: servono ~{needed} token, massimo {buckets[-1]}: "
+                    f"il testo sara' troncato ({prompt[:60]}...)")
+    return buckets[-1], needed
+
+
+class OllamaClient:
+    """
+    Linking client bound to one model and one system prompt.
+    num_ctx is a fixed size or "auto" (choose_num_ctx with ctx_buckets and output_budget);
+    ctx_stats records, for each size used, the number of calls and their total duration.
+    """
+
+    def __init__(self, model, system, base_url="http://localhost:11434", num_ctx=4096, temperature=0.01,
+                 keep_alive="30m", quiet=True, timeout=600, pool_size=4, cache=None,
+                 stop_on_json=False, format=None, ctx_buckets=CTX_BUCKETS, output_budget=1024,
+                 metrics=None, max_retries=2, retry_backoff=0.5, drain_chunks=8):
+        self.model = model
+        self.system = system
+        self.base_url = base_url.rstrip("/")
+        self.num_ctx = num_ctx
+        self.temperature = temperature
+        self.keep_alive = keep_alive
+        self.quiet = quiet
+        self.timeout = timeout
+        self.cache = cache
+        self.stop_on_json = stop_on_json
+        self.format = format
+        self.ctx_buckets = ctx_buckets
+        self.output_budget = output_budget
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.drain_chunks = drain_chunks
+        self.retries = 0
+        self.early_stops = 0
+        self.ctx_stats = {}
+        self._lock = threading.Lock()
+
+        # persistent keep-alive session, shared by all the calls of this model
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _num_ctx_for(self, prompt):
+        if self.num_ctx == "auto":
+            return choose_num_ctx(self.system, prompt, self.output_budget, self.ctx_buckets)[0]
+        return self.num_ctx
+
+    def _payload(self, prompt, stream, num_ctx, fmt=None):
+        payload = {
+            "model": self.model,
+            "system": self.system,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "num_ctx": num_ctx,
+                "temperature": self.temperature
+            }
+        }
+        if fmt is not None:
+            payload["format"] = fmt
+        return payload
+
+    def warm_up(self):
+        """
+        Load the model in memory before the first narrative (an empty prompt only loads the model),
+        with the same context size of the calls, otherwise Ollama reloads it at the first one.
+        The warm-up is only an optimization: a failure is logged and the run goes on.
+        """
+        try:
+            response = self.session.post(self.base_url + "/api/generate",
+                                         json={"model": self.model, "keep_alive": self.keep_alive,
+                                               "options": {"num_ctx": self._num_ctx_for("")}},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            return True
+        except requests.RequestException as e:
+            logging.warning(f"{self.model}: warm-up non riuscito ({e})")
+            return False
+
+    def _request(self, prompt, num_ctx, fmt=None):
+        """
+        Call the generate API, return the answer and the timing metadata of Ollama
+        """
+        if self.quiet and not self.stop_on_json:
+            response = self.session.post(self.base_url + "/api/generate", json=self._payload(prompt, False, num_ctx, fmt),
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            final = response.json()
+            return final.get("response", ""), final
+
+        parts = []
+        final = {}
+        detector = KeywordsJsonDetector() if self.stop_on_json else None
+        json_done = False
+        drained = 0
+        start = time.monotonic()
+        first_token = None
+        with self.session.post(self.base_url + "/api/generate", json=self._payload(prompt, True, num_ctx, fmt),
+                               timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                token = chunk.get("response", "")
+                if token and first_token is None:
+                    first_token = time.monotonic() - start
+                parts.append(token)
+                if not self.quiet:
+                    sys.stdout.write(token)
+                    sys.stdout.flush()
+                if chunk.get("done"):
+                    final = chunk
+                    break
+                if json_done:
+                    drained += 1
+                    if drained >= self.drain_chunks:
+                        # no final message after the json: closing the response cancels the rest of the generation
+                        final = {"early_stop": True}
+                        with self._lock:
+                            self.early_stops += 1
+                        break
+                elif detector is not None and detector.feed(token):
+                    # the json is complete: the final message of Ollama usually follows immediately
+                    json_done = True
+        if not self.quiet:
+            sys.stdout.write("\n")
+
+        if first_token is not None:
+            final["client_ttft"] = first_token
+        if detector is not None:
+            final["streamed_tokens"] = detector.tokens
+            final["think_end_token"] = detector.think_end_token
+        return "".join(parts), final
+
+    def generate(self, prompt, format=None, tags=None):
+        """
+        Send a text to the model and return the whole answer.
+        In quiet mode the answer is not echoed on stdout token by token.
+        `format` replaces the json schema of the client for this call, `tags` are saved with its metrics.
+        """
+        tags = tags or {}
+        fmt = format if format is not None else self.format
+        num_ctx = self._num_ctx_for(prompt)
+        start = time.monotonic()
+
+        if self.cache is not None:
+            key = self.cache.key(self.model, self.system, num_ctx, self.temperature, prompt, fmt)
+            entry = self.cache.get(key)
+            if entry is not None:
+                if self.metrics is not None:
+                    self.metrics.record(self.model, {}, time.monotonic() - start, num_ctx=num_ctx, cached=True,
+                                        **tags)
+                return entry["response"]
+
+        retries = 0
+        while True:
+            try:
+                text, final = self._request(prompt, num_ctx, fmt)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                status = e.response.status_code if getattr(e, "response", None) is not None else None
+                if retries >= self.max_retries or (status is not None and status < 500):
+                    raise
+                retries += 1
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.retry_backoff * 2 ** (retries - 1))
+        elapsed = time.monotonic() - start
+
+        # Ollama keeps the last num_ctx tokens: a prompt that fills the window has been truncated
+        prompt_tokens = final.get("prompt_eval_count")
+        if prompt_tokens is not None and prompt_tokens + final.get("eval_count", 0) >= num_ctx:
+            logging.warning(f"{self.model}: contesto di {num_ctx} token pieno "
+                            f"({prompt_tokens} di prompt), testo probabilmente troncato ({prompt[:60]}...)")
+
+        if self.metrics is not None:
+            extra = {k: final[k] for k in ("streamed_tokens", "client_ttft") if k in final}
+            extra.update(tags)
+            self.metrics.record(self.model, final, elapsed, num_ctx=num_ctx, prompt_chars=len(prompt),
+                                early_stop=final.get("early_stop", False), retries=retries, **extra)
+
+        with self._lock:
+            ctx = self.ctx_stats.setdefault(num_ctx, {"calls": 0, "seconds": 0.0})
+            ctx["calls"] += 1
+            ctx["seconds"] += elapsed
+
+        if self.cache is not None:
+            metadata = {k: v for k, v in final.items()
+                        if k.endswith("_duration") or k.endswith("_count") or k.endswith("_token") or k == "early_stop"}
+            metadata["wall_time"] = elapsed
+            metadata["num_ctx"] = num_ctx
+            self.cache.put(key, text, metadata)
+        return text
+
+    def __call__(self, prompt):
+        return self.generate(prompt)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
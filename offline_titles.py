@@ -0,0 +1,265 @@
+"""
+Offline Wikipedia title -> Wikidata QID lookup, built from the SQL dumps of Wikipedia.
+
+The `page`, `redirect` and `page_props` dumps of a language (https://dumps.wikimedia.org/<lang>wiki/latest/,
+e.g. enwiki-latest-page.sql.gz, .sql files work too) are streamed once, and the titles of the articles
+(namespace 0) with a QID (page_props "wikibase_item") are written in a compact index, together with the
+redirects already resolved to the QID of their target, like the Wikipedia APIs with redirects=1.
+The index is a sorted table of titles read with a memory map and a binary search, so a lookup does not
+load the whole file in memory:
+
+    header    b"WTQ1" + number of titles (uint64)
+    offsets   (n + 1) uint64, offsets of the titles in the blob
+    qids      n uint32, number of the QID
+    blob      the titles in utf-8, sorted
+
+python offline_titles.py build --language en --page enwiki-latest-page.sql.gz \\
+    --redirect enwiki-latest-redirect.sql.gz --page-props enwiki-latest-page_props.sql.gz
+python offline_titles.py lookup --language en "Alps" "value chain"
+
+With offline_folder (getWidataIdUsingWikipediaAPIs.process_json, resolvers.WikipediaTitleResolver)
+the titles are resolved with <offline_folder>/<language>wiki.idx instead of the APIs.
+fixtures/offline_titles/check_offline_titles.py builds the index of a tiny dump and checks the lookups.
+"""
+
+import argparse
+import bisect
+import gzip
+import mmap
+import os
+import re
+import struct
+import time
+
+MAGIC = b"WTQ1"
+DEFAULT_FOLDER = "offline"
+
+# values of the INSERT statements of the MySQL dumps
+VALUE = re.compile(r"'((?:[^'\\]|\\.)*)'|(NULL)|(-?[0-9][0-9.eE+-]*)|(\()|(\))")
+ESCAPES = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+COLUMN = re.compile(r"^\s*`(\w+)`", re.MULTILINE)
+
+
+def _unescape(value):
+    if "\\" not in value:
+        return value
+    return re.sub(r"\\(.)", lambda m: ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def iter_dump_rows(path):
+    """
+    Rows of the table of a MySQL dump, as dicts {column: value}, reading the columns from CREATE TABLE
+    """
+    columns = []
+    create = None
+    with _open_dump(path) as file:
+        for line in file:
+            if line.startswith("CREATE TABLE"):
+                create = []
+                continue
+            if create is not None:
+                if line.startswith(")"):
+                    columns = COLUMN.findall("".join(create))
+                    create = None
+                else:
+                    create.append(line)
+                continue
+            if not line.startswith("INSERT INTO"):
+                continue
+
+            row = None
+            for match in VALUE.finditer(line, line.index(" VALUES ")):
+                string, null, number, open_paren, close_paren = match.groups()
+                if open_paren:
+                    row = []
+                elif close_paren:
+                    if row is not None:
+                        yield dict(zip(columns, row))
+                    row = None
+                elif row is not None:
+                    if string is not None:
+                        row.append(_unescape(string))
+                    elif null:
+                        row.append(None)
+                    else:
+                        row.append(float(number) if "." in number or "e" in number.lower() else int(number))
+
+
+def normalize_title(title):
+    """
+    Title as saved by MediaWiki: spaces as underscores, no repeated or external spaces, first letter uppercase
+    """
+    title = re.sub(r"[\s_]+", " ", title).strip()
+    if not title:
+        return ""
+    return (title[0].upper() + title[1:]).replace(" ", "_")
+
+
+def build_index(page_dump, redirect_dump, page_props_dump, output, max_redirect_hops=5):
+    """
+    Stream the three dumps and write the index. Return the number of titles
+    """
+    start = time.monotonic()
+    qids = {}
+    for row in iter_dump_rows(page_props_dump):
+        if row.get("pp_propname") == "wikibase_item":
+            match = re.fullmatch(r"Q(\d+)", str(row.get("pp_value") or ""))
+            if match:
+                qids[row["pp_page"]] = int(match.group(1))
+    print(f"page_props: {len(qids)} pagine con un QID ({time.monotonic() - start:.0f}s)")
+
+    titles = {}
+    redirect_pages = {}
+    for row in iter_dump_rows(page_dump):
+        if row.get("page_namespace") != 0:
+            continue
+        if row.get("page_is_redirect"):
+            redirect_pages[row["page_id"]] = row["page_title"]
+        elif row["page_id"] in qids:
+            titles[row["page_title"]] = qids[row["page_id"]]
+    del qids
+    print(f"page: {len(titles)} articoli con un QID, {len(redirect_pages)} redirect ({time.monotonic() - start:.0f}s)")
+
+    targets = {}
+    for row in iter_dump_rows(redirect_dump):
+        source = redirect_pages.get(row.get("rd_from"))
+        if source is not None and row.get("rd_namespace") == 0 and not row.get("rd_interwiki"):
+            targets[source] = row["rd_title"]
+    del redirect_pages
+
+    resolved = 0
+    for source, target in targets.items():
+        hops = 0
+        while target in targets and target not in titles and hops < max_redirect_hops:
+            target = targets[target]
+            hops += 1
+        if target in titles and source not in titles:
+            titles[source] = titles[target]
+            resolved += 1
+    print(f"redirect: {resolved} redirect verso articoli con un QID ({time.monotonic() - start:.0f}s)")
+
+    write_index(titles, output)
+    return len(titles)
+
+
+def write_index(titles, output):
+    """
+    Write {title: QID number} in the index format
+    """
+    keys = sorted(title.encode("utf-8") for title in titles)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_path = output + ".tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(MAGIC + struct.pack("<Q", len(keys)))
+        offset = 0
+        offsets = [0]
+        for key in keys:
+            offset += len(key)
+            offsets.append(offset)
+        file.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        file.write(struct.pack(f"<{len(keys)}I", *(titles[key.decode("utf-8")] for key in keys)))
+        for key in keys:
+            file.write(key)
+    os.replace(tmp_path, output)
+
+
+class TitleIndex:
+    """
+    Read-only, memory-mapped title -> QID index
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:4] != MAGIC:
+            raise ValueError(f"{path} non e' un indice di offline_titles.py")
+        self.size = struct.unpack_from("<Q", self._map, 4)[0]
+        self._offsets = 12
+        self._qids = self._offsets + 8 * (self.size + 1)
+        self._blob = self._qids + 4 * self.size
+        self._keys = _Keys(self)
+
+    def _key(self, i):
+        start, end = struct.unpack_from("<2Q", self._map, self._offsets + 8 * i)
+        return self._map[self._blob + start:self._blob + end]
+
+    def get(self, title):
+        """
+        QID of a Wikipedia title (after the redirects), None if not found
+        """
+        if not isinstance(title, str):
+            return None
+        key = normalize_title(title).encode("utf-8")
+        i = bisect.bisect_left(self._keys, key)
+        if i < self.size and self._key(i) == key:
+            return "Q" + str(struct.unpack_from("<I", self._map, self._qids + 4 * i)[0])
+        return None
+
+    def get_many(self, titles):
+        return {title: self.get(title) for title in titles}
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class _Keys:
+    """
+    Sequence view of the sorted titles, for bisect
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.size
+
+    def __getitem__(self, i):
+        return self.index._key(i)
+
+
+_indexes = {}
+
+
+def load_index(language, folder=DEFAULT_FOLDER):
+    """
+    The index <folder>/<language>wiki.idx, opened once per process
+    """
+    path = os.path.join(folder, f"{language}wiki.idx")
+    if path not in _indexes:
+        _indexes[path] = TitleIndex(path)
+    return _indexes[path]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline Wikipedia title -> Wikidata QID lookup")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="build the index from the SQL dumps")
+    build_parser.add_argument("--language", default="en")
+    build_parser.add_argument("--page", required=True, help="<lang>wiki-latest-page.sql(.gz)")
+    build_parser.add_argument("--redirect", required=True, help="<lang>wiki-latest-redirect.sql(.gz)")
+    build_parser.add_argument("--page-props", required=True, help="<lang>wiki-latest-page_props.sql(.gz)")
+    build_parser.add_argument("--folder", default=DEFAULT_FOLDER)
+
+    lookup_parser = subparsers.add_parser("lookup", help="QIDs of some titles")
+    lookup_parser.add_argument("titles", nargs="+")
+    lookup_parser.add_argument("--language", default="en")
+    lookup_parser.add_argument("--folder", default=DEFAULT_FOLDER)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        output = os.path.join(args.folder, f"{args.language}wiki.idx")
+        count = build_index(args.page, args.redirect, args.page_props, output)
+        print(f"{count} titoli salvati in {output}")
+    else:
+        index = load_index(args.language, args.folder)
+        for title in args.titles:
+            print(f"{title}: {index.get(title)}")
@@ -2,80 +2,24 @@
 To run the script, install Ollama: https://ollama.com/
 """
 
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain.llms import Ollama
+from llm_client import OllamaClient
+from async_runner import run_async
+from result_store import ResultStore, export_json_files, done_units, prompt_id
+from progress import Progress
+from response_cache import ResponseCache
+from json_extraction import estrai_json_da_stringa, keywords_schema
+from chunking import split_windows, merge_mentions
+from telemetry import MetricsWriter
+from prompt_packing import build_batches, packed_prompt, packed_schema, split_packed_answer, saved_prompt_tokens
+from passages import PassageMemo, split_passages, fingerprint, attribute_mentions
 
-from json_repair import repair_json
 import json
-from difflib import SequenceMatcher
-import difflib
 
 import time
 import os
-import re
 import logging
 import csv
 
-# logger config
-logging.basicConfig(filename='error_log_moving.txt', level=logging.ERROR, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
-
-
-def estrai_json_da_stringa(stringa, percorso_file_json):
-    """
-    extract the json from a string (from an LLM's answer)
-    """
-    # regex to extract the JSON from a string
-    match = re.search(r'\{.*\}', stringa, re.DOTALL)
-    if match:
-        json_string = match.group(0)
-
-        
-        # removes punctuation marks
-        json_string_pulito = re.sub(r',\s*(\}|\])', r'\1', json_string)
-        
-        try:
-            return json.loads(json_string_pulito)
-        except json.JSONDecodeError as e:
-            # register the issue in the logger
-            logging.error(f"Errore nel JSON: {percorso_file_json}")
-            logging.error(f"Errore nel parsing del JSON: {e}")
-            logging.error(f"Stringa problematica: {json_string_pulito}")
-            logging.error(f"###")
-            logging.error(f"###")
-            logging.error(f"###")
-            try:
-                good_json_string = repair_json(json_string_pulito)
-                logging.error(f"**********")
-                logging.error(f"json riparato e inserito nel file")
-                logging.error(f"**********")
-                return json.loads(good_json_string)
-            except:
-                logging.error(f"$$$$$$$$$$")
-                logging.error(f"json Nemmeno riparato")
-                logging.error(f"$$$$$$$$$$")
-                return None
-    else:
-        logging.error(f"Nessun JSON valido trovato nella stringa: {stringa}")
-        return None
-
-def aggiorna_file_json(nuovi_dati, percorso_file):
-    """
-    Create and update the json files of the 30 MOVING narratives with the predictions of the LLMs
-    """
-    
-    if os.path.exists(percorso_file):
-        with open(percorso_file, 'r', encoding='utf-8') as file:
-            dati_esistenti = json.load(file)
-    else:
-        dati_esistenti = []
-
-    dati_esistenti.append(nuovi_dati)
-
-    with open(percorso_file, 'w', encoding='utf-8') as file:
-        json.dump(dati_esistenti, file, ensure_ascii=False, indent=4)
-
 
 # prompt 1
 systemPrompt= """recognize the keywords in the text and, for each of them, find the Wikidata ID. The final result should be a json like this:
@@ -97,6 +41,7 @@ systemPrompt= """recognize the keywords in the text and, for each of them, find
 
 Answer only with the json
 """
+id_field = "wikidata_id"   # field of the json schema used with structured_output
 
 # prompt 2
 # systemPrompt= """recognize the keywords in the text. The final result should be a json like this:
@@ -116,6 +61,7 @@ Answer only with the json
 
 # Answer only with the json
 # """
+# id_field = None
 
 # prompt 3
 # systemPrompt= """
@@ -142,64 +88,354 @@ Answer only with the json
 
 # Answer only with the json
 # """
+# id_field = "wikipedia_title"
 
 
 directory= "selected_MOVING_narratives/"
 listllms= [  "deepseek-r1:14b-qwen-distill-q8_0", "phi4:14b-q8_0", "llama2:13b-chat-q8_0", "llama3:8b-instruct-q8_0", "mistral:7b-instruct-q8_0", "gemma2:9b-instruct-q8_0", "gemma2:2b",  "llama3.2:3b", "phi3.5:latest"]
 
+# Ollama client parameters
+ollama_url = "http://localhost:11434"
+num_ctx = 4096       # "auto" to size the context on each narrative (buckets of llm_client.CTX_BUCKETS)
+output_budget = 1024  # tokens reserved for the answer with num_ctx = "auto"
+keep_alive = "30m"   # keep the model loaded between the rows
+warm_up = True       # load the model before the first narrative
+quiet = True         # False to print the answers token by token
+store_path = "movingJson/results.jsonl"   # append-only store of the answers
+concurrency = 1      # > 1 to send several rows in parallel (set OLLAMA_NUM_PARALLEL on the server)
+resume = True        # skip the (model, prompt, narrative, row) units already saved in the store
+stop_on_json = True  # stream the answer and stop the generation when the keywords json is complete
+chunk_chars = None   # e.g. 2000 to split the long rows in overlapping windows of chunk_chars characters
+chunk_overlap = 300  # characters shared by two consecutive windows
+pack_chars = None    # e.g. 3000 to send the short rows together, up to pack_chars characters per request
+pack_rows = 8        # rows per packed request
+passage_memo_path = None   # e.g. "movingJson/passages.jsonl" to send to the LLM only the passages not seen before
+passage_min_chars = 40     # shorter sentences are joined to the next one in a passage
+structured_output = False   # constrain the answer to the keywords json schema (Ollama structured output)
+parse_stats_path = "movingJson/parse_stats.jsonl"   # how the answers have been parsed, per model and run
+metrics_folder = "metrics"   # per-call telemetry (python telemetry.py metrics/ for the throughput report)
+use_cache = True     # reuse the answers already generated (same model, prompt, num_ctx, temperature and text)
+cache_folder = "llmcache"
+cache_max_bytes = 2 * 1024 ** 3
+
 
+def setup_logging():
+    """
+    Logger config of the scripts (called under __main__, importing ollama.py does not create the log file)
+    """
+    logging.basicConfig(filename='error_log_moving.txt', level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
 
-# cicle all the selected LLMs
-for llmModel in listllms:
-   
-   # cicle all the selected 30 MOVING narratives
+
+def load_narratives(directory):
+    """
+    Read the textual descriptions of the selected MOVING narratives.
+    Return a list of (filename, row, text), one element for each row of the CSV files
+    """
+    narratives = []
     for filename in os.listdir(directory):
-        
+
         if filename.endswith(".csv"):
             filepath = os.path.join(directory, filename)
-            
-                
+
             # onep the CSV
             with open(filepath, newline='', encoding='utf-8') as csvfile:
                 csvreader = csv.reader(csvfile)
-                
-                    
+
                 # skip the first line
                 next(csvreader)
-                    
 
-                for row in csvreader:
+                for i, row in enumerate(csvreader):
                     # get the second column value (textual description)
                     if len(row) > 1:
-   
-                        sen = row[1]
-
-                        # call Ollama 
-                        llm = Ollama(
-                            model=llmModel, 
-                            system=systemPrompt, 
-                            num_ctx=4096, 
-                            temperature=0.01, 
-                            callback_manager=CallbackManager([StreamingStdOutCallbackHandler()])
-                        )
-                        
-                        events = llm(sen)
-    
-                        # root to save the relut json file
-                        os.makedirs("movingJson/"+llmModel, exist_ok=True)
-                        percorso_file_json = 'movingJson/'+llmModel+'/'+filename+'.json'
-                        
-                        # extract json from the answer of the LLM
-                        json_estratto = estrai_json_da_stringa(events, percorso_file_json)
-                        
-                        if json_estratto:
-                            
-                            # save and update the json
-                            aggiorna_file_json(json_estratto, percorso_file_json)
-                        else:
-                            print("Nessun JSON trovato nella stringa.")
-                            my_jsone = {
-                                "keywords": []
-                                
-                            }
-                            aggiorna_file_json(my_jsone, percorso_file_json)
\ No newline at end of file
+                        narratives.append((filename, i, row[1]))
+    return narratives
+
+
+def salva_risposta(store, events, llmModel, filename, row, prompt=None, stats=None, windows=None, text=None):
+    """
+    Extract the json from the answer of the LLM and save it in the result store.
+    With windows (list of (start, window_text) of the text, see chunking.py) events is the list
+    of the answers of the windows, and their keywords are merged in one item.
+    """
+    percorso_file_json = 'movingJson/'+llmModel+'/'+filename+'.json'
+
+    # extract json from the answer of the LLM
+    if windows is None:
+        json_estratto = estrai_json_da_stringa(events, percorso_file_json, stats)
+    else:
+        json_estratto = merge_mentions(text, [(start, window_text, estrai_json_da_stringa(answer, percorso_file_json, stats))
+                                              for (start, window_text), answer in zip(windows, events)])
+
+    if not json_estratto:
+        print("Nessun JSON trovato nella stringa.")
+        json_estratto = {
+            "keywords": []
+        }
+
+    store.append(llmModel, filename, row, json_estratto, prompt=prompt)
+
+
+def process_model(llm, llmModel, store, concurrency=1, done=None, warm=False, stats=None, memo=None):
+    """
+    Extract the keywords of all the selected 30 MOVING narratives with one LLM.
+    With concurrency > 1 the rows are sent to Ollama in parallel and saved in row order.
+    The (model, prompt, narrative, row) units in `done` are skipped; with warm=True the model
+    is loaded before the first narrative (only if there is something left to do).
+    `stats` counts how the answers have been parsed (see estrai_json_da_stringa).
+    With a PassageMemo only the passages not seen before are sent to the LLM (chunk_chars is not used).
+    """
+    prompt = prompt_id(llm.system)
+    narratives = load_narratives(directory)
+    total = len(narratives)
+    if done:
+        narratives = [n for n in narratives if (llmModel, prompt, n[0], n[1]) not in done]
+    progress = Progress(llmModel, total, skipped=total - len(narratives))
+
+    if warm and narratives:
+        llm.warm_up()
+
+    # with pack_chars the short rows are sent together, the rows not found in the packed answers
+    # are sent again one by one below
+    if pack_chars and narratives:
+        narratives = process_packed(llm, llmModel, store, narratives, prompt, concurrency, stats, progress)
+
+    if memo is not None:
+        process_memoized(llm, llmModel, store, narratives, prompt, memo, concurrency, stats, progress)
+        return
+
+    # with chunk_chars the long rows are split in overlapping windows, sent as independent calls
+    windows = [split_windows(sen, chunk_chars, chunk_overlap) if chunk_chars else [(0, sen)]
+               for _, _, sen in narratives]
+    calls = [(i, window_text) for i, row_windows in enumerate(windows) for _, window_text in row_windows]
+    answers = [[] for _ in narratives]
+
+    def salva(k, events):
+        i = calls[k][0]
+        answers[i].append(events)
+        # save the row when the answers of all its windows are there
+        if len(answers[i]) == len(windows[i]):
+            filename, row, sen = narratives[i]
+            if chunk_chars:
+                salva_risposta(store, answers[i], llmModel, filename, row, prompt, stats, windows[i], sen)
+            else:
+                salva_risposta(store, events, llmModel, filename, row, prompt, stats)
+            answers[i] = None
+            progress.update()
+
+    if concurrency > 1:
+        run_async(llm, [window_text for _, window_text in calls], concurrency, on_result=salva)
+    else:
+        for k, (_, window_text) in enumerate(calls):
+            # call Ollama
+            salva(k, llm(window_text))
+
+
+def process_packed(llm, llmModel, store, narratives, prompt, concurrency=1, stats=None, progress=None):
+    """
+    Send the short rows packed in requests of at most pack_chars characters (see prompt_packing.py)
+    and save the rows found in the answers. Return the narratives still to do.
+    """
+    batches = [b for b in build_batches([sen for _, _, sen in narratives], pack_chars, pack_rows) if len(b) > 1]
+    if not batches:
+        return narratives
+
+    fmt = packed_schema(llm.format)
+    packed = set()
+
+    def salva(k, answer):
+        batch = batches[k]
+        filename = narratives[batch[0]][0]
+        items = split_packed_answer(answer, len(batch), 'movingJson/'+llmModel+'/'+filename+'.json', stats)
+        for position, item in items.items():
+            filename, row, _ = narratives[batch[position]]
+            store.append(llmModel, filename, row, item, prompt=prompt)
+            packed.add(batch[position])
+            if progress:
+                progress.update()
+
+    rows = [[narratives[i][2] for i in batch] for batch in batches]
+    texts = [packed_prompt(batch_rows) for batch_rows in rows]
+    # the rows of the call in the telemetry, for the measured saving of telemetry.py
+    tags = [{"packed_rows": len(batch_rows), "row_chars": sum(len(row) for row in batch_rows)} for batch_rows in rows]
+    if concurrency > 1:
+        run_async(lambda k: llm.generate(texts[k], format=fmt, tags=tags[k]), range(len(texts)), concurrency,
+                  on_result=salva)
+    else:
+        for k, text in enumerate(texts):
+            salva(k, llm.generate(text, format=fmt, tags=tags[k]))
+
+    sizes = [len(batch) for batch in batches]
+    missing = sum(sizes) - len(packed)
+    print(f"[{llmModel}] impacchettamento: {len(batches)} richieste per {sum(sizes)} righe, "
+          f"{missing} righe da rifare singolarmente, ~{saved_prompt_tokens(llm.system, rows)} token "
+          f"di prompt risparmiati (stima)")
+    return [n for i, n in enumerate(narratives) if i not in packed]
+
+
+def process_memoized(llm, llmModel, store, narratives, prompt, memo, concurrency=1, stats=None, progress=None,
+                     retry=True):
+    """
+    Send to the LLM only the passages of the rows not in the memo (and not sent for a previous row),
+    save the keywords of the new passages in the memo and the keywords of all the passages of each row
+    in the store (see passages.py).
+    The rows with a passage still missing from the memo (its answer could not be parsed) are not saved:
+    they are sent again once (retry=True), then left to the next run.
+    """
+    rows = [split_passages(sen, passage_min_chars) for _, _, sen in narratives]
+    claimed = set()
+    novel = []
+    for row_passages in rows:
+        indexes = []
+        for j, (_, passage) in enumerate(row_passages):
+            key = fingerprint(passage)
+            if key not in claimed and memo.get(llmModel, prompt, passage) is None:
+                indexes.append(j)
+            claimed.add(key)
+        novel.append(indexes)
+
+    missing = []
+
+    def salva_row(i):
+        filename, row, sen = narratives[i]
+        passage_items = [(start, passage, memo.get(llmModel, prompt, passage)) for start, passage in rows[i]]
+        if any(passage_item is None for _, _, passage_item in passage_items):
+            missing.append(i)
+            return
+        item = merge_mentions(sen, passage_items)
+        store.append(llmModel, filename, row, item, prompt=prompt)
+        if progress:
+            progress.update()
+
+    calls = [i for i, indexes in enumerate(novel) if indexes]
+    attribution = {}
+
+    def salva(k, answer):
+        i = calls[k]
+        passages = [rows[i][j] for j in novel[i]]
+        item = estrai_json_da_stringa(answer, 'movingJson/'+llmModel+'/'+narratives[i][0]+'.json', stats)
+        if item:
+            for (_, passage), passage_item in zip(passages, attribute_mentions(item, passages, attribution)):
+                memo.put(llmModel, prompt, passage, passage_item)
+        else:
+            print("Nessun JSON trovato nella stringa.")
+        salva_row(i)
+
+    texts = [" ".join(rows[i][j][1] for j in novel[i]) for i in calls]
+    if concurrency > 1:
+        run_async(llm, texts, concurrency, on_result=salva)
+    else:
+        for k, text in enumerate(texts):
+            salva(k, llm(text))
+
+    # the rows without new passages, when the passages of the previous rows are in the memo
+    for i, indexes in enumerate(novel):
+        if not indexes:
+            salva_row(i)
+
+    total_chars = sum(len(passage) for row_passages in rows for _, passage in row_passages)
+    sent_chars = sum(len(text) for text in texts)
+    total_passages = sum(len(row_passages) for row_passages in rows)
+    sent_passages = sum(len(indexes) for indexes in novel)
+    if total_chars:
+        print(f"[{llmModel}] memo dei passaggi: {sent_passages}/{total_passages} passaggi e "
+              f"{sent_chars}/{total_chars} caratteri inviati al modello ({1 - sent_chars / total_chars:.1%} risparmiati), "
+              f"{len(rows) - len(calls)} righe senza chiamate")
+    if attribution.get("unattributed"):
+        print(f"[{llmModel}] memo dei passaggi: {attribution['unattributed']} keyword non trovate nei passaggi, "
+              f"assegnate al primo passaggio nuovo della riga")
+
+    if missing and retry:
+        print(f"[{llmModel}] memo dei passaggi: {len(missing)} righe con passaggi senza risposta valida, le invio di nuovo")
+        process_memoized(llm, llmModel, store, [narratives[i] for i in sorted(missing)], prompt, memo, concurrency,
+                         stats, progress, retry=False)
+    elif missing:
+        print(f"[{llmModel}] memo dei passaggi: {len(missing)} righe non salvate (passaggi senza risposta valida), "
+              f"da rifare alla prossima esecuzione")
+
+
+def report_parse_stats(llmModel, prompt, structured, stats):
+    """
+    Print how the answers of a model have been parsed and save it in parse_stats_path.
+    In structured mode, compare with the last run without structured output: the repairs and
+    the failures (empty results) of that run are the ones avoided.
+    """
+    previous = None
+    if os.path.exists(parse_stats_path):
+        with open(parse_stats_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                record = json.loads(line)
+                if record["model"] == llmModel and record["prompt"] == prompt and not record["structured"]:
+                    previous = record["stats"]
+
+    os.makedirs(os.path.dirname(parse_stats_path), exist_ok=True)
+    with open(parse_stats_path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps({"model": llmModel, "prompt": prompt, "structured": structured,
+                               "stats": stats, "time": time.time()}) + "\n")
+
+    print(f"[{llmModel}] parsing delle risposte: {stats}")
+    if structured and previous is not None:
+        def problems(s):
+            return s.get("repaired", 0) + s.get("failed", 0) + s.get("no_json", 0)
+        print(f"[{llmModel}] riparazioni/fallimenti evitati rispetto all'output libero: "
+              f"{problems(previous) - problems(stats)} (prima {problems(previous)}, ora {problems(stats)})")
+
+
+def make_client(llmModel, system, fmt=None, cache=None, metrics=None, base_url=None, pool_size=None):
+    """
+    Ollama client of a model with the parameters of this script (pool_size: connections, default `concurrency`)
+    """
+    return OllamaClient(llmModel, system, base_url=base_url or ollama_url, num_ctx=num_ctx, temperature=0.01,
+                        keep_alive=keep_alive, quiet=quiet, pool_size=pool_size or concurrency, cache=cache,
+                        stop_on_json=stop_on_json, format=fmt, output_budget=output_budget, metrics=metrics)
+
+
+def run_models(models, system, id_field, store_path, output_folder, skip=None):
+    """
+    Run the prompt `system` with all the models, save the answers in the store and export them
+    in <output_folder>/<model>/<file>.csv.json (no export with output_folder=None).
+    The (model, prompt, narrative, row) units in `skip` are not run.
+    """
+    # units already completed by a previous (interrupted) run
+    done = done_units(store_path) if resume else set()
+    if skip:
+        done |= set(skip)
+    cache = ResponseCache(cache_folder, cache_max_bytes) if use_cache else None
+    memo = PassageMemo(passage_memo_path) if passage_memo_path else None
+    metrics = MetricsWriter(metrics_folder)
+
+    with ResultStore(store_path) as store:
+
+        # cicle all the selected LLMs
+        for llmModel in models:
+
+            # one client per model, reused for every narrative
+            with make_client(llmModel, system, keywords_schema(id_field) if structured_output else None,
+                             cache, metrics) as llm:
+                stats = {}
+                process_model(llm, llmModel, store, concurrency, done, warm=warm_up, stats=stats, memo=memo)
+                if stats:
+                    report_parse_stats(llmModel, prompt_id(system), structured_output, stats)
+                if stop_on_json:
+                    print(f"[{llmModel}] generazioni interrotte a json completo: {llm.early_stops}")
+                for size, ctx in sorted(llm.ctx_stats.items()):
+                    print(f"[{llmModel}] num_ctx {size}: {ctx['calls']} chiamate, "
+                          f"{ctx['seconds'] / ctx['calls']:.2f}s in media")
+
+            # write the <output_folder>/<model>/<file>.csv.json files read by evaluation.py
+            if output_folder:
+                export_json_files(store_path, output_folder, models=[llmModel], prompt=prompt_id(system))
+
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
+    if memo is not None:
+        memo.close()
+
+    metrics.close()
+    print(f"Metriche delle chiamate salvate in {metrics.path}")
+
+
+if __name__ == "__main__":
+
+    setup_logging()
+    run_models(listllms, systemPrompt, id_field, store_path, "movingJson")
@@ -0,0 +1,172 @@
+"""
+Passage memoization of the narrative text shared by many rows.
+
+Many MOVING rows repeat the same passages (the description of the project, the intro of the value
+chains...). A row is split in passages (sentences, the short ones joined to the next), every passage
+gets a fingerprint of its normalized text, and the keywords found in a passage by a model with a
+prompt are saved in a PassageMemo: the next rows send to the LLM only their novel passages, and the
+keywords of the known passages are taken from the memo.
+
+python passages.py                      dedup ratios of selected_MOVING_narratives and of the xlsx dataset
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_passages(text, min_chars=40):
+    """
+    Split a text in passages (sentences, the ones shorter than min_chars joined to the next).
+    Return a list of (start, passage_text), with start the offset of the passage in the text
+    """
+    passages = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        if match.start() - start >= min_chars:
+            passages.append((start, text[start:match.start()]))
+            start = match.end()
+    if text[start:].strip():
+        if passages and len(text) - start < min_chars:
+            # a short tail goes with the previous passage
+            previous_start, _ = passages.pop()
+            passages.append((previous_start, text[previous_start:].rstrip()))
+        else:
+            passages.append((start, text[start:].rstrip()))
+    return passages
+
+
+def fingerprint(passage):
+    """
+    Fingerprint of a passage: case and spaces do not matter
+    """
+    normalized = re.sub(r"\s+", " ", passage).strip().lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def attribute_mentions(item, passages, stats=None):
+    """
+    Split the keywords of the answer for the text of some passages: each keyword goes to the
+    passages where its mention is found (case and spaces do not matter). A keyword not found in any
+    passage (a mention rephrased by the model) goes to the first passage, and is counted in
+    stats["unattributed"]. Return a list of items, one per passage
+    """
+    items = [{"keywords": []} for _ in passages]
+    keywords = item.get("keywords", []) if isinstance(item, dict) else []
+    normalized_passages = [_normalize(passage) for _, passage in passages]
+    for keyword in keywords:
+        if not isinstance(keyword, dict):
+            continue
+        mention = _normalize(str(keyword.get("keyword_in_the_text") or ""))
+        found = False
+        if mention:
+            for i, normalized_passage in enumerate(normalized_passages):
+                if mention in normalized_passage:
+                    items[i]["keywords"].append(keyword)
+                    found = True
+        if not found and items:
+            items[0]["keywords"].append(keyword)
+            if stats is not None:
+                stats["unattributed"] = stats.get("unattributed", 0) + 1
+    return items
+
+
+class PassageMemo:
+    """
+    Append-only JSONL memo {(model, prompt, fingerprint): item}, loaded in memory at the start
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.items = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.items[(record["model"], record["prompt"], record["fingerprint"])] = record["item"]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def get(self, model, prompt, passage):
+        with self._lock:
+            return self.items.get((model, prompt, fingerprint(passage)))
+
+    def put(self, model, prompt, passage, item):
+        key = fingerprint(passage)
+        with self._lock:
+            if (model, prompt, key) in self.items:
+                return
+            self.items[(model, prompt, key)] = item
+            self._file.write(json.dumps({"model": model, "prompt": prompt, "fingerprint": key,
+                                         "item": item}, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def dedup_stats(texts, min_chars=40):
+    """
+    Passages and characters of the texts, total and unique (first occurrence of each fingerprint)
+    """
+    seen = set()
+    stats = {"texts": 0, "passages": 0, "unique_passages": 0, "chars": 0, "unique_chars": 0}
+    for text in texts:
+        stats["texts"] += 1
+        for _, passage in split_passages(text, min_chars):
+            key = fingerprint(passage)
+            stats["passages"] += 1
+            stats["chars"] += len(passage)
+            if key not in seen:
+                seen.add(key)
+                stats["unique_passages"] += 1
+                stats["unique_chars"] += len(passage)
+    stats["dedup_ratio"] = 1 - stats["unique_chars"] / stats["chars"] if stats["chars"] else 0.0
+    return stats
+
+
+def xlsx_texts(path):
+    """
+    Texts of the rows of the MOVING dataset: the textual cells of a row joined
+    """
+    import pandas as pd
+
+    texts = []
+    for _, row in pd.read_excel(path).iterrows():
+        cells = [value.strip() for value in row.values if isinstance(value, str) and value.strip()]
+        if cells:
+            texts.append("\n".join(cells))
+    return texts
+
+
+def print_dedup(label, stats):
+    print(f"{label}: {stats['texts']} testi, {stats['passages']} passaggi ({stats['unique_passages']} unici), "
+          f"{stats['chars']} caratteri ({stats['unique_chars']} unici) - deduplicazione {stats['dedup_ratio']:.1%}")
+
+
+if __name__ == "__main__":
+    import ollama
+
+    parser = argparse.ArgumentParser(description="Dedup ratios of the narrative passages")
+    parser.add_argument("--narratives", default=ollama.directory)
+    parser.add_argument("--xlsx", default="MOVING_VCs_DATASET_FINAL_V2.xlsx")
+    parser.add_argument("--min-chars", type=int, default=40)
+    args = parser.parse_args()
+
+    print_dedup(args.narratives, dedup_stats([text for _, _, text in ollama.load_narratives(args.narratives)],
+                                             args.min_chars))
+    if os.path.exists(args.xlsx):
+        print_dedup(args.xlsx, dedup_stats(xlsx_texts(args.xlsx), args.min_chars))
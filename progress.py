@@ -0,0 +1,68 @@
+"""
+Progress and ETA summary of a run
+"""
+
+import threading
+import time
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    return f"{minutes}m {seconds:02d}s"
+
+
+class Progress:
+    """
+    Count the completed units of a run and print the progress with the estimated remaining time.
+    The units skipped because already done (resume) are reported but not used for the ETA.
+    The progress is printed at most once every `interval` seconds (and at the last unit), or every
+    `every` units if given.
+    """
+
+    def __init__(self, label, total, skipped=0, every=None, interval=30.0):
+        self.label = label
+        self.total = total
+        self.skipped = skipped
+        self.every = every
+        self.interval = interval
+        self.done = 0
+        self.start = time.monotonic()
+        self.printed = self.start
+        self._lock = threading.Lock()
+
+        if skipped:
+            print(f"[{label}] {skipped}/{total} unita' gia' completate, riprendo dalle restanti {total - skipped}")
+
+    def eta(self):
+        """
+        Estimated seconds to the end of the run (None before the first unit)
+        """
+        if not self.done:
+            return None
+        elapsed = time.monotonic() - self.start
+        return elapsed / self.done * (self.total - self.skipped - self.done)
+
+    def update(self, n=1):
+        with self._lock:
+            self.done += n
+            now = time.monotonic()
+            if self.every:
+                due = self.done % self.every == 0
+            else:
+                due = now - self.printed >= self.interval
+            if due or self.skipped + self.done == self.total:
+                self.printed = now
+                print(self.summary())
+
+    def summary(self):
+        completed = self.skipped + self.done
+        elapsed = time.monotonic() - self.start
+        percent = 100 * completed / self.total if self.total else 100
+        text = f"[{self.label}] {completed}/{self.total} ({percent:.1f}%) - elapsed {_format_seconds(elapsed)}"
+        eta = self.eta()
+        if eta is not None:
+            text += f" - {elapsed / self.done:.1f}s/unit - ETA {_format_seconds(eta)}"
+        return text
@@ -0,0 +1,123 @@
+"""
+Packing of several short narrative rows in one request.
+
+The system prompt (prompt 3 in particular) is much longer than many rows: sending each short row
+alone makes the model prefill the same instructions again and again. Here the short rows are packed,
+with an id, in one prompt; the system prompt is the same of the single calls (so Ollama can also
+reuse the cached prefix between consecutive requests) and the answer
+{"texts": [{"id": 1, "keywords": [...]}, ...]} is split back per row. The rows missing from the
+answer are sent again one by one by the caller.
+"""
+
+from json_extraction import estrai_json_da_stringa
+from llm_client import estimate_tokens
+
+PACK_HEADER = """The input contains {n} separate texts, each one introduced by "### Text <id>".
+Apply the instructions to each text independently. The final result should be a json like this:
+
+### Json
+    {{
+        "texts": [
+            {{
+                "id": 1,
+                "keywords": [ ... ]
+            }},
+            ...
+        ]
+    }}
+
+with one element for each text, with the same id, and in "keywords" the keywords of that text only,
+in the format asked by the instructions. Answer only with the json
+
+"""
+
+
+def build_batches(texts, max_chars=3000, max_rows=8):
+    """
+    Group the indexes of the texts in batches of at most max_rows rows and max_chars characters.
+    The texts longer than max_chars / 2 are not packed (batches of one element)
+    """
+    batches = []
+    current = []
+    size = 0
+    for i, text in enumerate(texts):
+        if len(text) > max_chars / 2:
+            batches.append([i])
+            continue
+        if current and (size + len(text) > max_chars or len(current) == max_rows):
+            batches.append(current)
+            current = []
+            size = 0
+        current.append(i)
+        size += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def packed_prompt(texts):
+    """
+    Prompt with the texts of a batch, with ids 1..n
+    """
+    body = "\n\n".join(f"### Text {n}\n{text}" for n, text in enumerate(texts, start=1))
+    return PACK_HEADER.format(n=len(texts)) + body
+
+
+def packed_schema(keywords_format):
+    """
+    JSON schema of the packed answer from the keywords schema of the single calls
+    (None without structured output)
+    """
+    if keywords_format is None:
+        return None
+    return {
+        "type": "object",
+        "properties": {
+            "texts": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "keywords": keywords_format["properties"]["keywords"]
+                    },
+                    "required": ["id", "keywords"]
+                }
+            }
+        },
+        "required": ["texts"]
+    }
+
+
+def split_packed_answer(answer, n, percorso_file_json="", stats=None):
+    """
+    {position in the batch: {"keywords": [...]}} for the texts found in the answer (ids 1..n)
+    """
+    parsed = estrai_json_da_stringa(answer, percorso_file_json, stats)
+    items = {}
+    if not parsed or not isinstance(parsed.get("texts"), list):
+        return items
+    for element in parsed["texts"]:
+        if not isinstance(element, dict) or not isinstance(element.get("keywords"), list):
+            continue
+        try:
+            text_id = int(element.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= text_id <= n and text_id - 1 not in items:
+            items[text_id - 1] = {"keywords": element["keywords"]}
+    return items
+
+
+def saved_prompt_tokens(system, batches):
+    """
+    Estimated prompt-eval tokens saved by the packing of the batches (lists of texts): the system prompt
+    is evaluated once per batch instead of once per row, but every packed prompt adds PACK_HEADER and the
+    "### Text <id>" framing of its texts. The saving measured on the prompt_eval_count of Ollama is in
+    the report of telemetry.py
+    """
+    saved = 0
+    for texts in batches:
+        single = sum(estimate_tokens(system) + estimate_tokens(text) for text in texts)
+        saved += single - estimate_tokens(system) - estimate_tokens(packed_prompt(texts))
+    return saved
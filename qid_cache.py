@@ -0,0 +1,151 @@
+"""
+Persistent cache of the lookups to Wikidata QIDs, shared by the scripts and by the runs.
+
+One SQLite file (WAL mode: many readers and one writer at the same time, also from different
+processes) with a table of (kind, key) -> QID, where kind is
+- "wikipedia:<language>" for the Wikipedia titles (getWidataIdUsingWikipediaAPIs.py, the TAGME baseline),
+- "dbpedia" for the DBpedia URIs (the DBpedia Spotlight baseline, Frameworks_for_baseline/annotators.py),
+- "label:<language>" for the labels of the SPARQL queries (resolvers.SparqlLabelResolver),
+- "qid" for the QIDs checked with wbgetentities (resolvers.QidValidator).
+The negative results (no QID) are cached too, with a shorter TTL; the errors of the APIs are not cached.
+
+python qid_cache.py                   entries per kind
+python qid_cache.py --purge           remove the expired entries
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "qidcache.sqlite")
+DAY = 24 * 3600
+
+
+class QidCache:
+    """
+    (kind, key) -> QID or None (negative result), with expiry after ttl seconds (negative_ttl for None).
+    Every thread uses its own connection.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=90 * DAY, negative_ttl=7 * DAY):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = {}
+        self.misses = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS lookups (kind TEXT NOT NULL, key TEXT NOT NULL, "
+                               "qid TEXT, created REAL NOT NULL, PRIMARY KEY (kind, key))")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, kind, hits, misses):
+        with self._lock:
+            self.hits[kind] = self.hits.get(kind, 0) + hits
+            self.misses[kind] = self.misses.get(kind, 0) + misses
+
+    def get_many(self, kind, keys):
+        """
+        {key: QID or None} of the keys cached and not expired (the other keys are missing)
+        """
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found = {}
+        connection = self._connection()
+        # at most 500 parameters per query
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = connection.execute(
+                f"SELECT key, qid, created FROM lookups WHERE kind = ? AND key IN ({','.join('?' * len(chunk))})",
+                [kind, *chunk]).fetchall()
+            for key, qid, created in rows:
+                if now - created < (self.ttl if qid is not None else self.negative_ttl):
+                    found[key] = qid
+        self._count(kind, len(found), len(keys) - len(found))
+        return found
+
+    def lookup(self, kind, key):
+        """
+        (True, QID or None) if the key is cached, (False, None) otherwise
+        """
+        found = self.get_many(kind, [key])
+        return (True, found[key]) if key in found else (False, None)
+
+    def put_many(self, kind, results):
+        """
+        Save {key: QID or None}
+        """
+        now = time.time()
+        with self._connection() as connection:
+            connection.executemany("INSERT OR REPLACE INTO lookups (kind, key, qid, created) VALUES (?, ?, ?, ?)",
+                                   [(kind, key, qid, now) for key, qid in results.items()])
+
+    def put(self, kind, key, qid):
+        self.put_many(kind, {key: qid})
+
+    def resolve_many(self, kind, keys, resolve):
+        """
+        {key: QID or None} for all the keys: the missing ones are resolved with resolve(missing_keys)
+        (a dict, the keys not in it are errors and are not cached) and saved
+        """
+        results = self.get_many(kind, keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in results]
+        if missing:
+            resolved = resolve(missing)
+            self.put_many(kind, resolved)
+            results.update(resolved)
+        return results
+
+    def purge(self):
+        """
+        Remove the expired entries, return how many
+        """
+        now = time.time()
+        with self._connection() as connection:
+            cursor = connection.execute("DELETE FROM lookups WHERE (qid IS NOT NULL AND created < ?) "
+                                        "OR (qid IS NULL AND created < ?)", (now - self.ttl, now - self.negative_ttl))
+            return cursor.rowcount
+
+    def stats(self):
+        """
+        Hits, misses and hit rate of this process and entries in the file, per kind
+        """
+        entries = dict(self._connection().execute("SELECT kind, COUNT(*) FROM lookups GROUP BY kind").fetchall())
+        stats = {}
+        for kind in sorted(set(entries) | set(self.hits)):
+            hits, misses = self.hits.get(kind, 0), self.misses.get(kind, 0)
+            stats[kind] = {"hits": hits, "misses": misses,
+                           "hit_rate": hits / (hits + misses) if hits + misses else None,
+                           "entries": entries.get(kind, 0)}
+        return stats
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent cache of the QID lookups")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH)
+    parser.add_argument("--purge", action="store_true", help="remove the expired entries")
+    args = parser.parse_args()
+
+    cache = QidCache(args.path)
+    if args.purge:
+        print(f"{cache.purge()} voci scadute rimosse")
+    for kind, kind_stats in cache.stats().items():
+        print(f"{kind}: {kind_stats['entries']} voci")
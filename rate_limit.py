@@ -0,0 +1,214 @@
+"""
+Shared per-endpoint rate limiter for the annotators and the resolvers, instead of fixed sleeps.
+
+Every host (api.dbpedia-spotlight.org, dbpedia.org, tagme.d4science.org, en.wikipedia.org, ...) has one
+token bucket shared by all the sessions and threads of the process. The rate adapts to the service:
+it grows slowly after every successful request, up to max_rate, and is halved when the service throttles.
+A request is throttled when the answer is 429 or 503, or a MediaWiki maxlag error (the requests to the
+MediaWiki APIs are sent with maxlag=5); it is repeated after the Retry-After of the answer or, without
+it, an exponential backoff with jitter, and during the wait the whole endpoint is paused.
+After max_retries the last answer is returned, and the caller handles it like any other error.
+
+    session = LimitedSession()          # a requests.Session with the limiter
+    session.post(url, data=...)
+    print_report()                      # requests, throttled answers and time spent waiting, per endpoint
+
+The rates of the known services are in RATES; configure(host, rate=...) changes them.
+The local servers (LOOPBACK hosts, e.g. the stand-ins of sparql_stand_in.py) are not limited,
+unless they are configured explicitly.
+"""
+
+import email.utils
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+
+THROTTLE_STATUS = {429, 503}
+MEDIAWIKI_MAXLAG = 5
+
+# host: (requests per second, burst); the rate can grow up to 4 times this value
+RATES = {
+    "api.dbpedia-spotlight.org": (5, 5),
+    "dbpedia.org": (10, 10),
+    "query.wikidata.org": (2, 5),
+    "www.wikidata.org": (5, 5),
+    "labs.tib.eu": (1, 1),
+    "tagme.d4science.org": (2, 2),
+    "www.wikifier.org": (2, 2),
+}
+DEFAULT_RATE = (5, 5)
+LOOPBACK = {"localhost", "127.0.0.1", "::1"}
+
+
+def retry_after(response):
+    """
+    Seconds of the Retry-After header (seconds or HTTP date), None if missing
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(response):
+    return response.status_code in THROTTLE_STATUS or response.headers.get("MediaWiki-API-Error") == "maxlag"
+
+
+class EndpointLimiter:
+    """
+    Token bucket of one endpoint with additive increase and multiplicative decrease of the rate
+    """
+
+    def __init__(self, host, rate, burst, max_rate=None, min_rate=0.02, max_retries=5, base_backoff=1.0,
+                 max_backoff=120.0):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate or rate * 4
+        self.min_rate = min_rate
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "gave_up": 0, "wait_seconds": 0.0, "backoff_seconds": 0.0}
+
+    def acquire(self):
+        """
+        Take a token, waiting for it (and for the pause of the endpoint). Return the seconds waited
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # the tokens can go below zero: the next requests wait for the debt too
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate, self.paused_until - now)
+            self.stats["requests"] += 1
+            self.stats["wait_seconds"] += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+    def throttled(self, attempt, response, sent):
+        """
+        Halve the rate and pause the endpoint. Return the seconds to wait before the next attempt.
+        The rate is halved once for the requests sent before the last decrease (the concurrent ones)
+        """
+        delay = retry_after(response)
+        if delay is None:
+            # full jitter: uniform between 0 and the exponential backoff
+            delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        with self.lock:
+            if sent >= self.last_decrease:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.last_decrease = time.monotonic()
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.stats["throttled"] += 1
+            self.stats["backoff_seconds"] += delay
+        return delay
+
+    def send(self, send, method, url, **kwargs):
+        """
+        send(method, url, **kwargs) through the limiter, repeated while the endpoint throttles
+        """
+        if urllib.parse.urlparse(url).path.endswith("/api.php"):
+            kwargs["params"] = {"maxlag": MEDIAWIKI_MAXLAG, **(kwargs.get("params") or {})}
+        attempt = 0
+        while True:
+            self.acquire()
+            sent = time.monotonic()
+            response = send(method, url, **kwargs)
+            if not is_throttled(response):
+                self.succeeded()
+                return response
+            if attempt >= self.max_retries:
+                with self.lock:
+                    self.stats["gave_up"] += 1
+                return response
+            delay = self.throttled(attempt, response, sent)
+            logging.warning(f"{self.host}: risposta {response.status_code}, nuovo tentativo tra {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def configure(host, rate=None, burst=None, **options):
+    """
+    Change the settings of the limiter of a host (before or after its first request)
+    """
+    default_rate, default_burst = RATES.get(host, DEFAULT_RATE)
+    with _limiters_lock:
+        _limiters[host] = EndpointLimiter(host, rate or default_rate, burst or default_burst, **options)
+        return _limiters[host]
+
+
+def limiter_for(url):
+    """
+    The limiter shared by all the requests to the host of the url (None for a loopback host not configured)
+    """
+    host = urllib.parse.urlparse(url).hostname or url
+    with _limiters_lock:
+        if host not in _limiters:
+            if host in LOOPBACK:
+                return None
+            _limiters[host] = EndpointLimiter(host, *RATES.get(host, DEFAULT_RATE))
+        return _limiters[host]
+
+
+class LimitedSession(requests.Session):
+    """
+    requests.Session with every request through the limiter of its host
+    """
+
+    def request(self, method, url, params=None, **kwargs):
+        limiter = limiter_for(url)
+        if limiter is None:
+            return super().request(method, url, params=params, **kwargs)
+        return limiter.send(super().request, method, url, params=params, **kwargs)
+
+
+def report():
+    """
+    {host: stats with the current rate and the seconds spent throttled (waits for tokens + backoff,
+    summed over the threads)}
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    result = {}
+    for limiter in limiters:
+        with limiter.lock:
+            stats = dict(limiter.stats)
+            stats["rate"] = limiter.rate
+        stats["throttled_seconds"] = stats["wait_seconds"] + stats["backoff_seconds"]
+        result[limiter.host] = stats
+    return result
+
+
+def print_report():
+    for host, stats in report().items():
+        print(f"Rate limit {host}: {stats['requests']} richieste, {stats['throttled']} rallentate "
+              f"({stats['gave_up']} abbandonate), {stats['throttled_seconds']:.1f}s in attesa "
+              f"(token {stats['wait_seconds']:.1f}s, backoff {stats['backoff_seconds']:.1f}s), "
+              f"{stats['rate']:.2f} richieste/s")
@@ -0,0 +1,190 @@
+"""
+Resolvers of the keyword mentions found by the LLMs to Wikidata QIDs.
+
+A resolver reads one field of the mentions and resolves all its values at once
+(resolve_many(values) -> {value: QID or None}), so every linking strategy can be applied to the
+same mention set (see linking_pipeline.py):
+- WikipediaTitleResolver: "wikipedia_title" -> QID with the pageprops of the Wikipedia APIs, 50 titles
+  per request (approach 3)
+- SparqlLabelResolver: "keyword_in_the_text" -> QID with label queries to the Wikidata SPARQL endpoint, 50 labels
+  per query (approach 2)
+- QidValidator: "wikidata_id" suggested by the LLM -> the same QID if it exists in Wikidata (approach 1)
+- LocalLabelResolver: "keyword_in_the_text" -> QID with the local index of the Wikidata labels and
+  aliases of label_index.py (approach 2 without the SPARQL endpoint)
+With a QidCache (qid_cache.py) the lookups are saved and reused by the next runs.
+"""
+
+import re
+
+import requests
+
+from getWidataIdUsingWikipediaAPIs import get_wikidata_entities_from_wikipedia_titles
+from label_index import LabelIndex, DEFAULT_PATH as LABEL_INDEX_PATH
+from rate_limit import LimitedSession
+from sparql_batch import BatchSparqlResolver
+
+USER_AGENT = "Linking_keywords_in_narratives/1.0 (https://github.com/AIMH-DHgroup/Linking_keywords_in_narratives_with_smaller_LLMs)"
+
+
+class Resolver:
+    """
+    Base class: `name` is the name of the output folder, `field` the field of the mentions to resolve
+    """
+    name = None
+    field = None
+
+    def __init__(self, qid_cache=None):
+        self.qid_cache = qid_cache
+        self.session = LimitedSession()
+        self.session.headers["User-Agent"] = USER_AGENT
+
+    def cached(self, kind, keys, resolve):
+        """
+        resolve(keys) -> {key: QID or None} through the QidCache, if there is one
+        """
+        if self.qid_cache is None:
+            return resolve(keys)
+        return self.qid_cache.resolve_many(kind, keys, resolve)
+
+    def resolve_many(self, values):
+        raise NotImplementedError
+
+
+class WikipediaTitleResolver(Resolver):
+    name = "wikipedia"
+    field = "wikipedia_title"
+
+    def __init__(self, language="en", qid_cache=None, offline_folder=None):
+        super().__init__(qid_cache)
+        self.language = language
+        self.offline_folder = offline_folder
+
+    def resolve_many(self, values):
+        titles = [value for value in values if isinstance(value, str)]
+        return get_wikidata_entities_from_wikipedia_titles(self.language, titles, self.session,
+                                                           qid_cache=self.qid_cache, offline_folder=self.offline_folder)
+
+
+class SparqlLabelResolver(Resolver):
+    """
+    Look for the entities with the mention as label (as it is, then lowercase), like sparqlQuery.java,
+    with batch_size labels per query (sparql_batch.py)
+    """
+    name = "sparql"
+    field = "keyword_in_the_text"
+
+    def __init__(self, language="en", endpoint="https://query.wikidata.org/sparql", qid_cache=None, batch_size=50):
+        super().__init__(qid_cache)
+        self.language = language
+        self.endpoint = endpoint
+        self.batch = BatchSparqlResolver(endpoint, batch_size, session=self.session)
+
+    def _query_labels(self, labels):
+        """
+        {label: QID or None}, without the labels of the failed queries (not cached)
+        """
+        return self.batch.labels_to_wikidata(labels, self.language)
+
+    def _query_many(self, labels):
+        return self.cached(f"label:{self.language}", labels, self._query_labels)
+
+    def resolve_many(self, values):
+        # the values that are not strings (e.g. a list in keyword_in_the_text) are not resolved
+        mentions = {value: re.sub(r" +", " ", value.strip()) for value in values if isinstance(value, str)}
+        # the mentions as they are in batched queries, then the lowercase form of the ones not found
+        found = self._query_many([mention for mention in mentions.values() if mention])
+        lower = [mention.lower() for mention in mentions.values()
+                 if mention and found.get(mention) is None and mention.lower() != mention]
+        found_lower = self._query_many(lower) if lower else {}
+        results = {}
+        for value, mention in mentions.items():
+            qid = found.get(mention) if mention else None
+            if qid is None and mention:
+                qid = found_lower.get(mention.lower())
+            results[value] = qid
+        return results
+
+
+class QidValidator(Resolver):
+    """
+    Keep the QIDs suggested by the LLM that exist in Wikidata (following the redirects of merged items)
+    """
+    name = "qid"
+    field = "wikidata_id"
+
+    def __init__(self, api_url="https://www.wikidata.org/w/api.php", qid_cache=None):
+        super().__init__(qid_cache)
+        self.api_url = api_url
+
+    def _check_ids(self, id_list):
+        """
+        {QID: QID of the item (after the redirects) or None if missing}, without the ids of the failed requests
+        """
+        checked = {}
+        # wbgetentities accepts 50 ids per request
+        for i in range(0, len(id_list), 50):
+            chunk = id_list[i:i + 50]
+            params = {"action": "wbgetentities", "ids": "|".join(chunk), "props": "info", "format": "json"}
+            try:
+                response = self.session.get(self.api_url, params=params, timeout=60)
+                response.raise_for_status()
+                entities = response.json().get("entities", {})
+            except (requests.RequestException, ValueError) as e:
+                print(f"Errore wbgetentities: {e}")
+                continue
+            # a merged item comes back under the id of the target item, with "redirects"
+            by_id = dict(entities)
+            for entity in entities.values():
+                if "redirects" in entity:
+                    by_id[entity["redirects"]["from"]] = entity
+
+            for requested in chunk:
+                entity = by_id.get(requested, {})
+                checked[requested] = None if "missing" in entity or "id" not in entity else entity["id"]
+        return checked
+
+    def resolve_many(self, values):
+        results = {value: None for value in values}
+        ids = {}
+        for value in results:
+            match = re.search(r"Q\d+", str(value))
+            if match:
+                ids.setdefault(match.group(0), []).append(value)
+
+        checked = self.cached("qid", sorted(ids), self._check_ids)
+        for requested, qid in checked.items():
+            for value in ids[requested]:
+                results[value] = qid
+        return results
+
+
+class LocalLabelResolver(Resolver):
+    """
+    Look for the item with the mention as label or alias in the local index (as it is, then case folded),
+    the one with more sitelinks first
+    """
+    name = "labels"
+    field = "keyword_in_the_text"
+
+    def __init__(self, index_path=LABEL_INDEX_PATH, modes=("exact", "casefold"), qid_cache=None):
+        super().__init__(qid_cache)
+        self.index = LabelIndex(index_path)
+        self.modes = modes
+
+    def resolve_many(self, values):
+        results = {}
+        for value in set(values):
+            mention = re.sub(r" +", " ", str(value).strip())
+            results[value] = self.index.best(mention, self.modes) if mention else None
+        return results
+
+
+RESOLVERS = {
+    WikipediaTitleResolver.name: WikipediaTitleResolver,
+    SparqlLabelResolver.name: SparqlLabelResolver,
+    QidValidator.name: QidValidator,
+    LocalLabelResolver.name: LocalLabelResolver
+}
+
+# the resolvers run by default: LocalLabelResolver needs the index built with label_index.py
+DEFAULT_RESOLVERS = [WikipediaTitleResolver.name, SparqlLabelResolver.name, QidValidator.name]
@@ -0,0 +1,99 @@
+"""
+On-disk cache of the LLM answers, like the SHA1 file cache of the Wikidata queries in sparqlQuery.java.
+
+The key is the hash of (model tag, system prompt, num_ctx, temperature, input text); each entry is a
+llmcache/sha<key>.json file with the raw answer and its timing metadata. When the folder grows over
+max_bytes the least recently used entries are deleted (a hit refreshes the modification time of the file).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of the raw completions
+    """
+
+    def __init__(self, folder="llmcache", max_bytes=2 * 1024 ** 3):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(folder) if entry.name.endswith(".json"))
+
+    @staticmethod
+    def key(model, system, num_ctx, temperature, text, fmt=None):
+        values = [model, system, num_ctx, temperature, text]
+        if fmt is not None:
+            # structured output: the answers depend on the schema too
+            values.append(fmt)
+        data = json.dumps(values, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, "sha" + key + ".json")
+
+    def get(self, key):
+        """
+        Return the cached entry ({"response": ..., "metadata": {...}}) or None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # LRU: the modification time is the last use
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, response, metadata=None):
+        entry = {"response": response, "metadata": metadata or {}, "created": time.time()}
+        path = self._path(key)
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as file:
+            json.dump(entry, file, ensure_ascii=False)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._size += os.path.getsize(path) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # delete the least recently used entries until the cache is under 90% of max_bytes
+        entries = sorted((e for e in os.scandir(self.folder) if e.name.endswith(".json")),
+                         key=lambda e: e.stat().st_mtime)
+        for entry in entries:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_bytes": self._size
+        }
@@ -0,0 +1,146 @@
+"""
+Append-only JSONL store for the results of the LLMs and of the baseline frameworks.
+
+Every record is one line: {"model": ..., "prompt": ..., "narrative": ..., "row": ..., "item": {"keywords": [...]}}.
+A record is written with a single write and flushed to disk, so a crash can at most leave an
+incomplete last line, which is skipped when the store is read.
+export_json_files() compacts the store in the usual layout (one <narrative>.csv.json file with
+the list of the items of its rows), the one read by evaluation.py.
+The records already in the store are the checkpoints used to resume an interrupted run (done_units()).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+
+class ResultStore:
+    """
+    Append-only writer of the (model, narrative, row) records
+    """
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+
+        # an interrupted write leaves a line without "\n": close it, so the next record starts on a new line
+        if self._file.tell() > 0:
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != b"\n":
+                self._file.write(b"\n")
+                self._flush()
+
+    def _flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, model, narrative, row, item, prompt=None, **extra):
+        """
+        Save the item (the keywords found in a row of a narrative) of a model
+        """
+        record = {"model": model, "prompt": prompt, "narrative": narrative, "row": row, "item": item}
+        record.update(extra)
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+        with self._lock:
+            self._file.write(line)
+            self._flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path):
+    """
+    Read all the records of a store, skipping the incomplete or corrupted lines
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Riga non valida ignorata in {path}: {line[:80]}")
+
+
+def prompt_id(system_prompt):
+    """
+    Short identifier of a system prompt, saved in the records to tell apart the runs with different prompts
+    """
+    return hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def done_units(path):
+    """
+    Set of the (model, prompt, narrative, row) units already saved in a store
+    """
+    return {(r["model"], r.get("prompt"), r["narrative"], r["row"]) for r in read_records(path)}
+
+
+def save_json_atomic(data, percorso_file):
+    """
+    Save a json file with indent=4, like the files read by evaluation.py
+    """
+    # write a temporary file and replace the old one, so a crash never leaves a half-written json
+    tmp = percorso_file + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=4)
+    os.replace(tmp, percorso_file)
+
+
+def export_json_files(path, output_folder, models=None, subfolders=True, prompt=None, resolver=None):
+    """
+    Compact the store in the <output_folder>/<model>/<narrative>.json files
+    (directly in <output_folder> with subfolders=False), optionally keeping only the records of one prompt
+    and of one resolver (the "resolver" field of the linked stores).
+    Items are ordered by row; when a row has been saved more than once the last record wins,
+    so a rerun never shifts the alignment with the gold standard.
+    """
+    grouped = {}
+    for record in read_records(path):
+        if models is not None and record["model"] not in models:
+            continue
+        if prompt is not None and record.get("prompt") != prompt:
+            continue
+        if resolver is not None and record.get("resolver") != resolver:
+            continue
+        grouped.setdefault((record["model"], record["narrative"]), {})[record["row"]] = record["item"]
+
+    for (model, narrative), rows in grouped.items():
+        folder = os.path.join(output_folder, model) if subfolders else output_folder
+        os.makedirs(folder, exist_ok=True)
+        items = [rows[row] for row in sorted(rows)]
+        save_json_atomic(items, os.path.join(folder, narrative + ".json"))
+
+    return len(grouped)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a JSONL result store in the *.csv.json layout")
+    parser.add_argument("store", help="path of the JSONL store")
+    parser.add_argument("output_folder", help="folder of the exported json files")
+    parser.add_argument("--model", action="append", help="export only this model (repeatable)")
+    parser.add_argument("--prompt", help="export only the records of this prompt id")
+    parser.add_argument("--flat", action="store_true", help="do not create one subfolder per model")
+    args = parser.parse_args()
+
+    n = export_json_files(args.store, args.output_folder, args.model, subfolders=not args.flat, prompt=args.prompt)
+    print(f"Esportati {n} file in {args.output_folder}")
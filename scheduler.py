@@ -0,0 +1,310 @@
+"""
+Work-queue scheduler to spread a sweep of ollama.py (models x narrative rows) over several Ollama hosts.
+
+The sweep is a manifest of (model, prompt, narrative, row) units. Each host is pinned to as few models
+as possible (assign_models), so it does not swap models in memory: it takes the units of its models
+first and, only when they are finished, helps with the model with most units left (and keeps it).
+A unit failed on a host (connection error, timeout, HTTP error after the retries of the client, or any
+error while parsing and saving the answer) goes back at the end of the queue, and the host that failed it
+takes it again only if nothing else is left; after max_attempts failures the unit is given up (it is
+run again by the next sweep). A host with max_host_failures consecutive connection/HTTP failures is dropped.
+The answers are saved in the result store of ollama.py and exported in movingJson/<model>/ as usual.
+
+python scheduler.py --hosts http://box1:11434 http://box2:11434 --workers 2
+
+To try it locally, start some stand-in servers (fake_ollama_server.py) on different ports:
+python fake_ollama_server.py --port 11501 & python fake_ollama_server.py --port 11502 --failure-rate 0.3 &
+python scheduler.py --hosts http://127.0.0.1:11501 http://127.0.0.1:11502
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+
+import ollama
+from chunking import split_windows
+from json_extraction import keywords_schema
+from progress import Progress
+from response_cache import ResponseCache
+from result_store import ResultStore, done_units, export_json_files, prompt_id
+from telemetry import MetricsWriter
+
+
+def build_manifest(models, system, narratives, done=None):
+    """
+    Work units (model, prompt, narrative, row, text) of the sweep, without the ones in `done`
+    """
+    prompt = prompt_id(system)
+    return [(model, prompt, filename, row, text)
+            for model in models
+            for filename, row, text in narratives
+            if not done or (model, prompt, filename, row) not in done]
+
+
+def write_manifest(units, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        for model, prompt, filename, row, _ in units:
+            file.write(json.dumps({"model": model, "prompt": prompt, "narrative": filename, "row": row}) + "\n")
+
+
+def assign_models(models, hosts):
+    """
+    {host: [models]}: with more hosts than models every host gets one model (the hosts are shared
+    among the models), otherwise the models are split in contiguous groups of similar size
+    """
+    if not models or not hosts:
+        return {host: [] for host in hosts}
+    if len(hosts) >= len(models):
+        return {host: [models[i % len(models)]] for i, host in enumerate(hosts)}
+    assignment = {host: [] for host in hosts}
+    for i, model in enumerate(models):
+        assignment[hosts[i * len(hosts) // len(models)]].append(model)
+    return assignment
+
+
+class WorkQueue:
+    """
+    Units pending per model, with the units in flight: a worker waits while some units in flight
+    can still come back (requeue), and stops when nothing is pending or in flight.
+    A failed unit goes back at the end of its queue, at most max_attempts times (then it is in `failed`)
+    """
+
+    def __init__(self, units, max_attempts=3):
+        self.pending = {}
+        for unit in units:
+            self.pending.setdefault(unit[0], deque()).append(unit)
+        self.max_attempts = max_attempts
+        self.attempts = {}
+        self.failed_hosts = {}
+        self.failed = []
+        self.in_flight = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def _take(self, model, host):
+        """
+        First unit of the model not failed by the host (any unit with host=None)
+        """
+        queue = self.pending.get(model)
+        for i, unit in enumerate(queue or ()):
+            if host is None or host not in self.failed_hosts.get(unit[:4], ()):
+                del queue[i]
+                return unit
+        return None
+
+    def _pick(self, pinned, host):
+        for model in reversed(pinned):
+            unit = self._take(model, host)
+            if unit is not None:
+                if model != pinned[-1]:
+                    pinned.remove(model)
+                    pinned.append(model)
+                return unit
+        # the models of the host are finished: help with the model with most units left
+        left = sorted((model for model, queue in self.pending.items() if queue and model not in pinned),
+                      key=lambda model: -len(self.pending[model]))
+        for model in left:
+            unit = self._take(model, host)
+            if unit is not None:
+                pinned.append(model)
+                return unit
+        return None
+
+    def get(self, pinned, host=None):
+        """
+        Next unit for a host with the models `pinned` (list, updated when the host takes a new model;
+        the last one is the model used last, tried first so the host keeps it loaded).
+        The units failed by the host are taken only when no other unit is left
+        """
+        with self._condition:
+            while True:
+                if self.closed:
+                    return None
+                unit = self._pick(pinned, host)
+                if unit is None and host is not None:
+                    unit = self._pick(pinned, None)
+                if unit is not None:
+                    self.in_flight += 1
+                    return unit
+                if not self.in_flight:
+                    return None
+                self._condition.wait()
+
+    def done(self, unit, failed=False, host=None):
+        with self._condition:
+            self.in_flight -= 1
+            if failed:
+                key = unit[:4]
+                self.attempts[key] = self.attempts.get(key, 0) + 1
+                if host is not None:
+                    self.failed_hosts.setdefault(key, set()).add(host)
+                if self.attempts[key] >= self.max_attempts:
+                    self.failed.append(unit)
+                else:
+                    self.pending[unit[0]].append(unit)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def left(self):
+        with self._condition:
+            return sum(len(queue) for queue in self.pending.values())
+
+
+class HostWorker:
+    """
+    Units processed by one Ollama host, with one client per model
+    """
+
+    def __init__(self, host, pinned, system, fmt=None, cache=None, metrics=None, max_host_failures=3,
+                 pool_size=1):
+        self.host = host
+        self.pinned = list(pinned)
+        self.system = system
+        self.fmt = fmt
+        self.cache = cache
+        self.metrics = metrics
+        self.max_host_failures = max_host_failures
+        self.pool_size = pool_size
+        self.clients = {}
+        self.stats = {"units": 0, "failures": 0, "models": 0}
+        self.consecutive_failures = 0
+        self.alive = True
+        self._lock = threading.Lock()
+
+    def client(self, model):
+        with self._lock:
+            if model not in self.clients:
+                self.clients[model] = ollama.make_client(model, self.system, self.fmt, self.cache,
+                                                         self.metrics, base_url=self.host, pool_size=self.pool_size)
+                self.stats["models"] += 1
+            return self.clients[model]
+
+    def run(self, queue, store, stats, progress):
+        while self.alive:
+            unit = queue.get(self.pinned, self.host)
+            if unit is None:
+                return
+            model, prompt, filename, row, text = unit
+            failed = True
+            try:
+                llm = self.client(model)
+                if ollama.chunk_chars:
+                    windows = split_windows(text, ollama.chunk_chars, ollama.chunk_overlap)
+                    answers = [llm(window_text) for _, window_text in windows]
+                    ollama.salva_risposta(store, answers, model, filename, row, prompt, stats, windows, text)
+                else:
+                    ollama.salva_risposta(store, llm(text), model, filename, row, prompt, stats)
+                failed = False
+            except requests.RequestException as e:
+                with self._lock:
+                    self.stats["failures"] += 1
+                    self.consecutive_failures += 1
+                    if self.consecutive_failures >= self.max_host_failures:
+                        self.alive = False
+                print(f"[{self.host}] {model} {filename} riga {row} rimessa in coda: {e}")
+            except Exception as e:
+                # not an error of the host (parsing, saving, ...): the unit is retried, the host is kept
+                with self._lock:
+                    self.stats["failures"] += 1
+                logging.exception(f"[{self.host}] {model} {filename} riga {row} rimessa in coda: {e!r}")
+            finally:
+                # always, otherwise the other workers wait for this unit forever
+                queue.done(unit, failed=failed, host=self.host)
+            if failed:
+                continue
+            with self._lock:
+                self.stats["units"] += 1
+                self.consecutive_failures = 0
+            progress.update()
+
+    def close(self):
+        for llm in self.clients.values():
+            llm.close()
+
+
+def run_sweep(models, system, id_field, hosts, store_path, output_folder, workers_per_host=1,
+              max_host_failures=3, manifest_path=None, max_attempts=3):
+    """
+    Run the sweep models x narratives of ollama.py on the hosts and export the answers
+    in <output_folder>/<model>/<file>.csv.json. Return the stats per host.
+    """
+    done = done_units(store_path) if ollama.resume else None
+    narratives = ollama.load_narratives(ollama.directory)
+    units = build_manifest(models, system, narratives, done)
+    if manifest_path:
+        write_manifest(units, manifest_path)
+
+    total = len(models) * len(narratives)
+    progress = Progress("sweep", total, skipped=total - len(units))
+    queue = WorkQueue(units, max_attempts)
+    cache = ResponseCache(ollama.cache_folder, ollama.cache_max_bytes) if ollama.use_cache else None
+    metrics = MetricsWriter(ollama.metrics_folder)
+    fmt = keywords_schema(id_field) if ollama.structured_output else None
+    parse_stats = {}
+
+    assignment = assign_models(models, hosts)
+    workers = [HostWorker(host, assignment[host], system, fmt, cache, metrics, max_host_failures, workers_per_host)
+               for host in hosts]
+
+    start = time.monotonic()
+    with ResultStore(store_path) as store:
+        threads = []
+        for worker in workers:
+            for _ in range(workers_per_host):
+                thread = threading.Thread(target=worker.run, args=(queue, store, parse_stats, progress), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        # when all the hosts are dropped the units left cannot be done
+        while any(thread.is_alive() for thread in threads):
+            if not any(worker.alive for worker in workers):
+                queue.close()
+            time.sleep(0.2)
+
+    for worker in workers:
+        worker.close()
+    metrics.close()
+
+    for model in models:
+        export_json_files(store_path, output_folder, models=[model], prompt=prompt_id(system))
+
+    print(f"Sweep completato in {time.monotonic() - start:.1f}s, parsing delle risposte: {parse_stats}")
+    for worker in workers:
+        state = "attivo" if worker.alive else "escluso"
+        print(f"[{worker.host}] {state}: {worker.stats['units']} unita', {worker.stats['failures']} errori, "
+              f"modelli {worker.pinned}")
+    if queue.failed:
+        print(f"{len(queue.failed)} unita' abbandonate dopo {max_attempts} tentativi: rilancia per riprendere")
+    left = queue.left()
+    if left:
+        print(f"{left} unita' non completate: tutti gli host sono stati esclusi, rilancia per riprendere")
+    return {worker.host: dict(worker.stats, alive=worker.alive, models=worker.pinned) for worker in workers}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spread the ollama.py sweep over several Ollama hosts")
+    parser.add_argument("--hosts", nargs="+", default=[ollama.ollama_url], help="base urls of the Ollama servers")
+    parser.add_argument("--models", nargs="+", default=ollama.listllms)
+    parser.add_argument("--workers", type=int, default=1, help="requests in flight per host (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--max-host-failures", type=int, default=3,
+                        help="consecutive failures before a host is dropped")
+    parser.add_argument("--max-attempts", type=int, default=3, help="failures of a unit before it is given up")
+    parser.add_argument("--store", default=ollama.store_path)
+    parser.add_argument("--output", default="movingJson")
+    parser.add_argument("--manifest", default="movingJson/manifest.jsonl")
+    args = parser.parse_args()
+    ollama.setup_logging()
+
+    run_sweep(args.models, ollama.systemPrompt, ollama.id_field, args.hosts, args.store, args.output,
+              args.workers, args.max_host_failures, args.manifest, args.max_attempts)
@@ -0,0 +1,156 @@
+"""
+Batched SPARQL resolution: many DBpedia URIs or labels in the VALUES block of one query.
+
+Instead of one query per URI (DBpedia Spotlight baseline, Frameworks_for_baseline/annotators.py) or
+per label (resolvers.SparqlLabelResolver), up to batch_size inputs are sent in one query, and every row of the
+answer is mapped back to its input through the ?input variable. When a query fails for a timeout or
+for its size (HTTP 413/414/431 or 5xx), the batch is split in two halves, down to min_batch_size;
+the inputs of the batches that still fail are left out of the results (errors, not "not found").
+
+sparql_stand_in.py is a local endpoint for the tests and the benchmarks:
+python sparql_stand_in.py --synthetic 10000 --max-values 200 &
+python sparql_batch.py --endpoint http://127.0.0.1:8890/sparql --synthetic 2000 --batch-size 500
+"""
+
+import argparse
+import logging
+import re
+import time
+
+import requests
+
+from rate_limit import LimitedSession
+
+# status codes of the queries too large or too slow for the endpoint
+SPLIT_STATUS = {413, 414, 431, 500, 502, 503, 504}
+WIKIDATA_ENTITY = "http://www.wikidata.org/entity/"
+# characters not allowed in a SPARQL IRIREF
+IRI_FORBIDDEN = re.compile(r'[<>"{}|^`\\\x00-\x20]')
+
+
+def _iri(uri):
+    """
+    URI in a SPARQL IRIREF: only the characters not allowed are percent-encoded, the non-ASCII ones are
+    kept (http://dbpedia.org/resource/Zürich and .../Z%C3%BCrich are different IRIs on DBpedia)
+    """
+    return "<" + IRI_FORBIDDEN.sub(lambda m: "%{:02X}".format(ord(m.group())), uri) + ">"
+
+
+def _literal(label, language):
+    return '"' + label.replace("\\", "\\\\").replace('"', '\\"') + '"@' + language
+
+
+class BatchSparqlResolver:
+    """
+    Client of a SPARQL endpoint for batched lookups. `stats` counts requests, splits and failed inputs
+    """
+
+    def __init__(self, endpoint, batch_size=50, min_batch_size=1, timeout=60, session=None, user_agent=None):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.timeout = timeout
+        self.session = session or LimitedSession()
+        if user_agent:
+            self.session.headers["User-Agent"] = user_agent
+        self.stats = {"requests": 0, "splits": 0, "failed": 0}
+
+    def _query(self, query):
+        self.stats["requests"] += 1
+        response = self.session.post(self.endpoint, data={"query": query},
+                                     headers={"Accept": "application/sparql-results+json"}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get("results", {}).get("bindings", [])
+
+    def _run(self, inputs, build_query, result_of, results):
+        try:
+            bindings = self._query(build_query(inputs))
+        except (requests.Timeout, requests.HTTPError) as e:
+            status = e.response.status_code if getattr(e, "response", None) is not None else None
+            if (status is None or status in SPLIT_STATUS) and len(inputs) > self.min_batch_size:
+                # too large or too slow: the two halves separately
+                self.stats["splits"] += 1
+                half = len(inputs) // 2
+                self._run(inputs[:half], build_query, result_of, results)
+                self._run(inputs[half:], build_query, result_of, results)
+                return
+            logging.error(f"SPARQL: {len(inputs)} valori non risolti: {e}")
+            self.stats["failed"] += len(inputs)
+            return
+        except (requests.RequestException, ValueError) as e:
+            logging.error(f"SPARQL: {len(inputs)} valori non risolti: {e}")
+            self.stats["failed"] += len(inputs)
+            return
+
+        found = {}
+        for binding in bindings:
+            key, value = result_of(binding)
+            if key is not None and value is not None:
+                found.setdefault(key, value)
+        for key in inputs:
+            results[key] = found.get(key)
+
+    def resolve(self, inputs, build_query, result_of):
+        """
+        {input: result or None}: build_query(list of inputs) is the query of a batch and
+        result_of(binding) gives (input, result) of a row of the answer
+        """
+        inputs = list(dict.fromkeys(inputs))
+        results = {}
+        for i in range(0, len(inputs), self.batch_size):
+            self._run(inputs[i:i + self.batch_size], build_query, result_of, results)
+        return results
+
+    def dbpedia_to_wikidata(self, uris):
+        """
+        {DBpedia URI: QID or None} from the owl:sameAs links to Wikidata
+        """
+        encoded = {_iri(uri)[1:-1]: uri for uri in uris}
+
+        def build_query(batch):
+            values = " ".join(_iri(uri) for uri in batch)
+            return ("SELECT ?input ?wikidata WHERE { VALUES ?input { " + values + " } "
+                    "?input <http://www.w3.org/2002/07/owl#sameAs> ?wikidata . "
+                    f'FILTER(STRSTARTS(STR(?wikidata), "{WIKIDATA_ENTITY}")) }}')
+
+        def result_of(binding):
+            uri = binding.get("input", {}).get("value")
+            wikidata = binding.get("wikidata", {}).get("value")
+            return encoded.get(uri, uri), wikidata.rsplit("/", 1)[-1] if wikidata else None
+
+        return self.resolve(list(uris), build_query, result_of)
+
+    def labels_to_wikidata(self, labels, language="en"):
+        """
+        {label: QID or None} of the entities with the label (rdfs:label in the language)
+        """
+        def build_query(batch):
+            values = " ".join(_literal(label, language) for label in batch)
+            return "SELECT ?input ?entity WHERE { VALUES ?input { " + values + " } ?entity rdfs:label ?input . }"
+
+        def result_of(binding):
+            entity = binding.get("entity", {}).get("value", "")
+            if not entity.startswith(WIKIDATA_ENTITY):
+                return None, None
+            return binding.get("input", {}).get("value"), entity.rsplit("/", 1)[-1]
+
+        return self.resolve(list(labels), build_query, result_of)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the batched SPARQL resolution")
+    parser.add_argument("--endpoint", default="http://127.0.0.1:8890/sparql")
+    parser.add_argument("--synthetic", type=int, default=1000, help="DBpedia URIs of the synthetic fixture to resolve")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 50, 200])
+    args = parser.parse_args()
+
+    from sparql_stand_in import synthetic_uri
+
+    uris = [synthetic_uri(i) for i in range(args.synthetic)]
+    for batch_size in args.batch_size:
+        resolver = BatchSparqlResolver(args.endpoint, batch_size)
+        start = time.monotonic()
+        results = resolver.dbpedia_to_wikidata(uris)
+        elapsed = time.monotonic() - start
+        found = sum(1 for qid in results.values() if qid)
+        print(f"batch {batch_size:>5}: {elapsed:6.2f}s, {found}/{len(uris)} trovati, {resolver.stats}")
@@ -0,0 +1,233 @@
+"""
+Local SPARQL endpoint stand-in, to test and benchmark the batched resolution of sparql_batch.py
+without DBpedia and Wikidata.
+
+The triples are read from an N-Triples fixture (--fixture, e.g. fixtures/sparql_batch/dbpedia.nt) or generated
+(--synthetic N: N DBpedia resources, one in four with a non-ASCII name, 90% of them with an owl:sameAs link
+to a Wikidata item, and the rdfs:label of the items).
+Only the query shapes of sparql_batch.py are understood: a VALUES block of IRIs or literals and one
+triple pattern with the VALUES variable as subject or object, with an optional
+FILTER(STRSTARTS(STR(?var), "...")). The answers use the SPARQL 1.1 JSON results format.
+Like a real endpoint it can be slow (--request-latency, --value-latency) and refuse the large queries:
+HTTP 500 "Query timeout" above --max-values values and HTTP 414 above --max-query-bytes bytes.
+GET /stats returns the counters of the server.
+
+python sparql_stand_in.py --port 8890 --synthetic 10000 --max-values 200
+"""
+
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIXES = {
+    "rdfs:label": "<http://www.w3.org/2000/01/rdf-schema#label>",
+    "owl:sameAs": "<http://www.w3.org/2002/07/owl#sameAs>"
+}
+TERM = r'<[^>\s]*>|"(?:[^"\\]|\\.)*"(?:@[\w-]+)?'
+TRIPLE = re.compile(rf"^\s*({TERM})\s+({TERM})\s+({TERM})\s*\.\s*$")
+VALUES = re.compile(r"VALUES\s+\?(\w+)\s*\{(.*?)\}", re.DOTALL)
+PATTERN = re.compile(rf"(\?\w+|{TERM})\s+(<[^>\s]*>|\w+:\w+)\s+(\?\w+|{TERM})\s*\.")
+FILTER = re.compile(r'FILTER\s*\(\s*STRSTARTS\s*\(\s*STR\s*\(\s*\?(\w+)\s*\)\s*,\s*"([^"]*)"\s*\)\s*\)')
+
+
+def synthetic_uri(i):
+    # DBpedia IRIs keep the non-ASCII characters (not percent-encoded)
+    if i % 4 == 3:
+        return f"http://dbpedia.org/resource/Città_sintetica_{i}"
+    return f"http://dbpedia.org/resource/Synthetic_{i}"
+
+
+def synthetic_triples(n):
+    """
+    N DBpedia resources, with a sameAs link to Wikidata for 9 of every 10, and the labels of the items
+    """
+    triples = []
+    for i in range(n):
+        item = f"<http://www.wikidata.org/entity/Q{1000 + i}>"
+        if i % 10 != 9:
+            triples.append((f"<{synthetic_uri(i)}>", PREFIXES["owl:sameAs"], item))
+        triples.append((item, PREFIXES["rdfs:label"], f'"Synthetic {i}"@en'))
+    return triples
+
+
+def load_ntriples(path):
+    triples = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            match = TRIPLE.match(line)
+            if match:
+                triples.append(match.groups())
+    return triples
+
+
+def _binding(term):
+    if term.startswith("<"):
+        return {"type": "uri", "value": term[1:-1]}
+    value, _, language = term.rpartition('"')
+    binding = {"type": "literal", "value": re.sub(r'\\(.)', r'\1', value[1:])}
+    if language.startswith("@"):
+        binding["xml:lang"] = language[1:]
+    return binding
+
+
+class SparqlState:
+    """
+    Triples indexed by (subject, predicate) and (predicate, object), configuration and counters
+    """
+
+    def __init__(self, triples, request_latency=0.0, value_latency=0.0, max_values=None, max_query_bytes=None):
+        self.by_subject = {}
+        self.by_object = {}
+        for subject, predicate, obj in triples:
+            self.by_subject.setdefault((subject, predicate), []).append(obj)
+            self.by_object.setdefault((predicate, obj), []).append(subject)
+        self.request_latency = request_latency
+        self.value_latency = value_latency
+        self.max_values = max_values
+        self.max_query_bytes = max_query_bytes
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "values": 0, "timeouts": 0, "too_large": 0, "errors": 0}
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def evaluate(self, query):
+        """
+        (variables, bindings, number of VALUES values) of a query, ValueError if the shape is not supported
+        """
+        values = VALUES.search(query)
+        pattern = PATTERN.search(query, values.end()) if values else None
+        if not values or not pattern:
+            raise ValueError("query non supportata dallo stand-in")
+        variable = values.group(1)
+        terms = re.findall(TERM, values.group(2))
+        subject, predicate, obj = pattern.groups()
+        predicate = PREFIXES.get(predicate, predicate)
+        filters = FILTER.findall(query)
+        if subject == "?" + variable and obj.startswith("?"):
+            other, index, key = obj[1:], self.by_subject, lambda term: (term, predicate)
+        elif obj == "?" + variable and subject.startswith("?"):
+            other, index, key = subject[1:], self.by_object, lambda term: (predicate, term)
+        else:
+            raise ValueError("pattern non supportato dallo stand-in")
+
+        bindings = []
+        for term in terms:
+            for match in index.get(key(term), []):
+                row = {variable: term, other: match}
+                if all(row.get(var, "<")[1:].startswith(prefix) for var, prefix in filters):
+                    bindings.append({var: _binding(value) for var, value in row.items()})
+        return [variable, other], bindings, len(terms)
+
+
+class SparqlHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body in one write (flushed after every request), without the delayed ACK of two writes
+    wbufsize = 65536
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send(self, status, body, content_type="application/sparql-results+json"):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/stats":
+            with self.state.lock:
+                self._send(200, json.dumps(self.state.stats), "application/json")
+            return
+        query = urllib.parse.parse_qs(url.query).get("query", [""])[0]
+        self._answer(query)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        if self.headers.get("Content-Type", "").startswith("application/sparql-query"):
+            query = body
+        else:
+            query = urllib.parse.parse_qs(body).get("query", [""])[0]
+        self._answer(query)
+
+    def _answer(self, query):
+        state = self.state
+        state.count("requests")
+        if state.max_query_bytes and len(query.encode("utf-8")) > state.max_query_bytes:
+            state.count("too_large")
+            self._send(414, "Request-URI Too Long", "text/plain")
+            return
+        try:
+            variables, bindings, n_values = state.evaluate(query)
+        except ValueError as e:
+            state.count("errors")
+            self._send(400, str(e), "text/plain")
+            return
+
+        state.count("values", n_values)
+        if state.max_values and n_values > state.max_values:
+            # like a real endpoint, the query runs until the timeout
+            time.sleep(state.request_latency)
+            state.count("timeouts")
+            self._send(500, "Query timeout", "text/plain")
+            return
+        time.sleep(state.request_latency + state.value_latency * n_values)
+        self._send(200, json.dumps({"head": {"vars": variables},
+                                    "results": {"bindings": bindings}}))
+
+
+class SparqlServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients that close the connection (e.g. a timeout of the client) are not errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def start_server(host="127.0.0.1", port=0, triples=(), **options):
+    """
+    Start a stand-in endpoint in a background thread (port=0: a free port).
+    Return (server, endpoint url); stop it with server.shutdown()
+    """
+    server = SparqlServer((host, port), SparqlHandler)
+    server.state = SparqlState(triples, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/sparql"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local SPARQL endpoint stand-in for the batched resolution")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8890)
+    parser.add_argument("--fixture", help="N-Triples file")
+    parser.add_argument("--synthetic", type=int, default=0, help="number of synthetic DBpedia resources")
+    parser.add_argument("--request-latency", type=float, default=0.05, help="seconds per query")
+    parser.add_argument("--value-latency", type=float, default=0.001, help="seconds per VALUES value")
+    parser.add_argument("--max-values", type=int, help="larger VALUES blocks fail with a timeout")
+    parser.add_argument("--max-query-bytes", type=int, help="larger queries fail with HTTP 414")
+    args = parser.parse_args()
+
+    triples = load_ntriples(args.fixture) if args.fixture else []
+    triples += synthetic_triples(args.synthetic)
+    server = SparqlServer((args.host, args.port), SparqlHandler)
+    server.state = SparqlState(triples, args.request_latency, args.value_latency, args.max_values, args.max_query_bytes)
+    print(f"Stand-in SPARQL su http://{args.host}:{args.port}/sparql ({len(triples)} triple)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,240 @@
+"""
+Staged pipeline: LLM generation, json extraction, QID resolution and persistence overlapped.
+
+Each stage has its worker threads and a bounded queue in front of it: while the GPU generates the
+next rows, the previous answers are parsed, their mentions resolved on the network (resolvers.py)
+and written to disk. When a stage is slower than the one before, its queue fills up and the
+previous stage waits (backpressure), so the memory stays bounded.
+The resolve stage collects up to resolve_batch rows (waiting at most resolve_wait seconds for them,
+the generation is usually much slower), so the mentions of several rows are resolved together with
+the batched requests of the resolvers.
+The linked items are saved with the name of the resolver, so every resolver has its own
+checkpoints and export.
+At the end the utilisation of each stage (busy time / (wall time x workers)) shows the bottleneck.
+
+python staged_pipeline.py --resolver qid --generate-workers 2 --resolve-workers 4
+"""
+
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+import ollama
+from json_extraction import estrai_json_da_stringa, keywords_schema
+from linking_pipeline import link_items
+from resolvers import RESOLVERS
+from qid_cache import QidCache
+from rate_limit import print_report
+from result_store import ResultStore, read_records, export_json_files, prompt_id
+
+# end of the input of a stage
+_END = object()
+
+
+class Stage:
+    """
+    `workers` threads applying `function` to the items of queue_in and putting the results in
+    queue_out (None for the last stage). An item that raises is logged and dropped.
+    With batch_size > 1 `function` gets a list of at most batch_size items of queue_in, collected for
+    at most batch_wait seconds after the first one, and returns the list of their results.
+    """
+
+    def __init__(self, name, function, workers=1, queue_in=None, queue_out=None, batch_size=1, batch_wait=0.0):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue_in = queue_in
+        self.queue_out = queue_out
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0      # seconds spent in function
+        self.idle = 0.0      # seconds waiting for an input
+        self.blocked = 0.0   # seconds waiting for space in the next queue (backpressure)
+        self._running = workers
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        busy = idle = blocked = 0.0
+        while True:
+            start = time.monotonic()
+            item = self.queue_in.get()
+            idle += time.monotonic() - start
+            if item is _END:
+                # the other workers of the stage stop too
+                self.queue_in.put(_END)
+                break
+
+            batch = [item]
+            ended = False
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                start = time.monotonic()
+                try:
+                    item = self.queue_in.get(timeout=max(0.0, deadline - start))
+                except queue.Empty:
+                    break
+                finally:
+                    idle += time.monotonic() - start
+                if item is _END:
+                    ended = True
+                    break
+                batch.append(item)
+
+            start = time.monotonic()
+            try:
+                results = self.function(batch) if self.batch_size > 1 else [self.function(batch[0])]
+            except Exception as e:
+                logging.error(f"Stage {self.name}: {e}")
+                with self._lock:
+                    self.errors += len(batch)
+                results = []
+            busy += time.monotonic() - start
+
+            with self._lock:
+                self.items += len(results)
+            if self.queue_out is not None:
+                start = time.monotonic()
+                for result in results:
+                    self.queue_out.put(result)
+                blocked += time.monotonic() - start
+            if ended:
+                self.queue_in.put(_END)
+                break
+
+        with self._lock:
+            self.busy += busy
+            self.idle += idle
+            self.blocked += blocked
+            self._running -= 1
+            last = self._running == 0
+        # the last worker closes the input of the next stage
+        if last and self.queue_out is not None:
+            self.queue_out.put(_END)
+
+    def utilisation(self, wall_time):
+        return self.busy / (wall_time * self.workers) if wall_time else 0.0
+
+
+def print_stage_report(stages, wall_time):
+    print(f"{'Stage':<10} {'workers':>7} {'items':>6} {'errors':>6} {'busy s':>8} {'idle s':>8} "
+          f"{'blocked s':>9} {'util':>6}")
+    print("-" * 68)
+    for stage in stages:
+        print(f"{stage.name:<10} {stage.workers:>7} {stage.items:>6} {stage.errors:>6} {stage.busy:>8.1f} "
+              f"{stage.idle:>8.1f} {stage.blocked:>9.1f} {stage.utilisation(wall_time):>6.1%}")
+    bottleneck = max(stages, key=lambda stage: stage.utilisation(wall_time))
+    print(f"Collo di bottiglia: {bottleneck.name} ({bottleneck.utilisation(wall_time):.1%} di utilizzo)")
+
+
+def run_pipeline(llmModel, system, id_field, resolver_name, store_path, linked_store_path, output_folder,
+                 queue_size=8, generate_workers=1, resolve_workers=4, resolve_batch=16, resolve_wait=10.0):
+    """
+    Run one model on the narratives through the four stages. The answers are saved in store_path
+    (as in ollama.py), the linked items in linked_store_path and exported in
+    <output_folder>/<resolver>/<model>/<file>.csv.json. Return the stages.
+    """
+    prompt = prompt_id(system)
+    # the rows already linked with this resolver
+    done = {(r["model"], r.get("prompt"), r["narrative"], r["row"]) for r in read_records(linked_store_path)
+            if r.get("resolver") == resolver_name} if ollama.resume else set()
+    narratives = [n for n in ollama.load_narratives(ollama.directory) if (llmModel, prompt, n[0], n[1]) not in done]
+    if not narratives:
+        print(f"[{llmModel}] tutte le righe sono gia' state elaborate")
+        return []
+    resolver = RESOLVERS[resolver_name](qid_cache=QidCache())
+    fmt = keywords_schema(id_field) if ollama.structured_output else None
+    parse_stats = {}
+
+    with ollama.make_client(llmModel, system, fmt, pool_size=generate_workers) as llm, \
+            ResultStore(store_path) as store, ResultStore(linked_store_path) as linked_store:
+
+        def generate(unit):
+            filename, row, text = unit
+            return unit, llm(text)
+
+        def extract(result):
+            (filename, row, text), answer = result
+            item = estrai_json_da_stringa(answer, 'movingJson/'+llmModel+'/'+filename+'.json', parse_stats)
+            return (filename, row), item or {"keywords": []}
+
+        def resolve(results):
+            # the mentions of all the rows of the batch in one resolve_many
+            linked = link_items([item for _, item in results], resolver)
+            return [(unit, item, linked_item) for (unit, item), linked_item in zip(results, linked)]
+
+        def write(result):
+            (filename, row), item, linked = result
+            store.append(llmModel, filename, row, item, prompt=prompt)
+            linked_store.append(llmModel, filename, row, linked, prompt=prompt, resolver=resolver_name)
+
+        queues = [queue.Queue(maxsize=queue_size) for _ in range(4)]
+        stages = [
+            Stage("generate", generate, generate_workers, queues[0], queues[1]),
+            Stage("extract", extract, 1, queues[1], queues[2]),
+            Stage("resolve", resolve, resolve_workers, queues[2], queues[3], resolve_batch, resolve_wait),
+            Stage("write", write, 1, queues[3])
+        ]
+
+        start = time.monotonic()
+        for stage in stages:
+            stage.start()
+        if narratives and ollama.warm_up:
+            llm.warm_up()
+        for unit in narratives:
+            queues[0].put(unit)
+        queues[0].put(_END)
+        for stage in stages:
+            stage.join()
+        wall_time = time.monotonic() - start
+
+    export_json_files(linked_store_path, os.path.join(output_folder, resolver_name), models=[llmModel], prompt=prompt,
+                      resolver=resolver_name)
+    print(f"[{llmModel}] {len(narratives)} righe in {wall_time:.1f}s, parsing delle risposte: {parse_stats}")
+    print_stage_report(stages, wall_time)
+    print_report()
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM generation, json extraction, QID resolution and writing overlapped")
+    parser.add_argument("--model", action="append", help="model (repeatable, default: ollama.listllms)")
+    parser.add_argument("--resolver", choices=list(RESOLVERS),
+                        help="default: the resolver of the id field of the prompt of ollama.py")
+    parser.add_argument("--queue-size", type=int, default=8, help="items waiting between two stages")
+    parser.add_argument("--generate-workers", type=int, default=ollama.concurrency)
+    parser.add_argument("--resolve-workers", type=int, default=4)
+    parser.add_argument("--resolve-batch", type=int, default=16, help="rows resolved together at most")
+    parser.add_argument("--resolve-wait", type=float, default=10.0, help="seconds to collect the rows of a batch")
+    parser.add_argument("--store", default=ollama.store_path)
+    parser.add_argument("--linked-store", default="linked/results.jsonl")
+    parser.add_argument("--output", default="linked")
+    args = parser.parse_args()
+    ollama.setup_logging()
+
+    resolver_name = args.resolver or next(name for name, resolver in RESOLVERS.items()
+                                          if resolver.field == (ollama.id_field or "keyword_in_the_text"))
+    for llmModel in args.model or ollama.listllms:
+        try:
+            run_pipeline(llmModel, ollama.systemPrompt, ollama.id_field, resolver_name, args.store,
+                         args.linked_store, args.output, args.queue_size, args.generate_workers,
+                         args.resolve_workers, args.resolve_batch, args.resolve_wait)
+        except requests.RequestException as e:
+            print(f"[{llmModel}] errore: {e}")
@@ -0,0 +1,200 @@
+"""
+Per-call inference telemetry of the LLM runs and throughput report per model.
+
+Every call of OllamaClient writes one line in the metrics file of the run (metrics/run_<time>.jsonl)
+with the metadata returned by Ollama (token counts and durations in nanoseconds).
+The packed calls (ollama.pack_chars) are saved with packed_rows and row_chars, and the report
+compares their prompt_eval_count with the single calls of the same model.
+
+python telemetry.py metrics/                  report of all the runs in the folder
+python telemetry.py metrics/run_1700000000.jsonl
+"""
+
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+
+# metadata of the final answer of the Ollama generate API
+OLLAMA_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration",
+                 "total_duration", "load_duration")
+
+
+class MetricsWriter:
+    """
+    Append-only, thread-safe writer of the per-call metrics of a run
+    """
+
+    def __init__(self, folder="metrics", run_id=None):
+        os.makedirs(folder, exist_ok=True)
+        self.run_id = run_id or str(int(time.time()))
+        self.path = os.path.join(folder, f"run_{self.run_id}.jsonl")
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, model, final, wall_time, **extra):
+        """
+        Save the metadata of one call (`final` is the last message of Ollama)
+        """
+        entry = {"run": self.run_id, "model": model, "time": time.time(), "wall_time": wall_time}
+        for field in OLLAMA_FIELDS:
+            if field in final:
+                entry[field] = final[field]
+        entry.update(extra)
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def load_metrics(paths):
+    records = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "*.jsonl"))) if os.path.isdir(path) else [path]
+        for file_path in files:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        try:
+                            records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            pass
+    return records
+
+
+def throughput_report(records):
+    """
+    Aggregate the calls per model: generation and prompt tokens/sec, p50/p95 latency, model-load time.
+    The latency is always the wall time measured by the client. The cached calls are counted but not
+    used for the speed; the calls stopped early (stop_on_json, no final metadata from Ollama) are
+    counted in "early", and the generation speed uses their streamed tokens only when no call of the
+    model has the metadata of Ollama.
+    """
+    by_model = {}
+    for record in records:
+        by_model.setdefault(record["model"], []).append(record)
+
+    report = []
+    for model, calls in by_model.items():
+        generated = [c for c in calls if not c.get("cached")]
+        eval_count = sum(c.get("eval_count", 0) for c in generated)
+        eval_seconds = sum(c.get("eval_duration", 0) for c in generated) / 1e9
+        prompt_count = sum(c.get("prompt_eval_count", 0) for c in generated)
+        prompt_seconds = sum(c.get("prompt_eval_duration", 0) for c in generated) / 1e9
+        if not eval_seconds:
+            # estimate from the client: streamed tokens after the first one
+            early = [c for c in generated if c.get("early_stop") and "client_ttft" in c]
+            eval_count = sum(c.get("streamed_tokens", 0) for c in early)
+            eval_seconds = sum(c["wall_time"] - c["client_ttft"] for c in early)
+        latencies = [c["wall_time"] for c in generated]
+        ttfts = [c["client_ttft"] for c in generated if "client_ttft" in c]
+        loads = [c.get("load_duration", 0) / 1e9 for c in generated]
+
+        report.append({
+            "model": model,
+            "calls": len(calls),
+            "cached": sum(1 for c in calls if c.get("cached")),
+            "early": sum(1 for c in generated if c.get("early_stop")),
+            "gen_tok_s": eval_count / eval_seconds if eval_seconds else None,
+            "prompt_tok_s": prompt_count / prompt_seconds if prompt_seconds else None,
+            "p50_s": _percentile(latencies, 50),
+            "p95_s": _percentile(latencies, 95),
+            "ttft_s": _percentile(ttfts, 50),
+            "load_s": sum(loads),
+            "max_load_s": max(loads) if loads else None
+        })
+
+    report.sort(key=lambda r: -(r["gen_tok_s"] or 0))
+    return report
+
+
+def packing_report(records):
+    """
+    Prompt-eval tokens saved by the packed calls, measured per model: the prompt_eval_count of the single
+    calls is fitted as fixed tokens (system prompt) + tokens per character of the row, the expected cost
+    of the rows of every packed call sent one by one is compared with its prompt_eval_count
+    (that includes the header and the framing of the packed prompt)
+    """
+    by_model = {}
+    for record in records:
+        if not record.get("cached") and "prompt_eval_count" in record and "prompt_chars" in record:
+            by_model.setdefault(record["model"], []).append(record)
+
+    report = []
+    for model, calls in by_model.items():
+        packed = [c for c in calls if c.get("packed_rows")]
+        single = [c for c in calls if not c.get("packed_rows")]
+        if not packed:
+            continue
+        fixed = per_char = None
+        xs = [c["prompt_chars"] for c in single]
+        ys = [c["prompt_eval_count"] for c in single]
+        if len(set(xs)) > 1:
+            # least squares of prompt_eval_count on prompt_chars
+            mean_x = sum(xs) / len(xs)
+            mean_y = sum(ys) / len(ys)
+            per_char = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+            fixed = mean_y - per_char * mean_x
+        packed_tokens = sum(c["prompt_eval_count"] for c in packed)
+        rows = sum(c["packed_rows"] for c in packed)
+        unpacked_tokens = None
+        if fixed is not None:
+            unpacked_tokens = sum(c["packed_rows"] * fixed + c.get("row_chars", 0) * per_char for c in packed)
+        report.append({
+            "model": model,
+            "packed_calls": len(packed),
+            "packed_rows": rows,
+            "single_calls": len(single),
+            "packed_tokens": packed_tokens,
+            "unpacked_tokens": unpacked_tokens,
+            "saved_tokens": None if unpacked_tokens is None else unpacked_tokens - packed_tokens
+        })
+    return report
+
+
+def print_report(report):
+    def fmt(value, digits=2):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    print(f"{'Model':<36} {'calls':>6} {'cached':>6} {'early':>6} {'gen tok/s':>10} {'prompt tok/s':>13} "
+          f"{'p50 s':>8} {'p95 s':>8} {'ttft s':>8} {'load s':>8} {'max load s':>10}")
+    print("-" * 130)
+    for r in report:
+        print(f"{r['model']:<36} {r['calls']:>6} {r['cached']:>6} {r['early']:>6} {fmt(r['gen_tok_s'], 1):>10} "
+              f"{fmt(r['prompt_tok_s'], 1):>13} {fmt(r['p50_s']):>8} {fmt(r['p95_s']):>8} "
+              f"{fmt(r['ttft_s']):>8} {fmt(r['load_s']):>8} {fmt(r['max_load_s']):>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput report of the LLM runs")
+    parser.add_argument("paths", nargs="*", default=["metrics"], help="metrics files or folders")
+    args = parser.parse_args()
+
+    records = load_metrics(args.paths)
+    if not records:
+        print("Nessuna metrica trovata.")
+    else:
+        print_report(throughput_report(records))
+        for r in packing_report(records):
+            if r["saved_tokens"] is None:
+                print(f"{r['model']}: {r['packed_rows']} righe in {r['packed_calls']} richieste impacchettate, "
+                      f"{r['packed_tokens']} token di prompt (servono chiamate singole di lunghezze diverse "
+                      f"per il confronto)")
+            else:
+                print(f"{r['model']}: {r['packed_rows']} righe in {r['packed_calls']} richieste impacchettate, "
+                      f"{r['packed_tokens']} token di prompt invece di ~{r['unpacked_tokens']:.0f} "
+                      f"({r['saved_tokens']:.0f} risparmiati, misurati su {r['single_calls']} chiamate singole)")